@@ -5,99 +5,421 @@ Runs the main game-loop.
 """
 
 # Imports
+from core.startup import trace
+import math
 import os
-import platform
+import signal
 import sys
-import abc
-import numpy as np
 import time
-import pygame
 import io
-from io import BytesIO
-from pathlib import Path
-from plugins.clock import ClockPlugin
-import paho.mqtt.client as mqtt
+from core.config import ConfigWatcher, flush_config, load_config, write_atomic
+from core.layout import load_layout
+from core.frames import FrameExchange
+from core.messages import MessageQueue
+from core.metrics import Metrics
+from core.recorder import RECORD_FRAMES, FrameRecorder
+from core.scheduler import FrameScheduler
+
+trace.mark("import")
 
 # Global variables
 DISPLAY_WIDTH = 12
 DISPLAY_HEIGTH = 12
 
 
-class WordClock:
-    def __init__(self):
-        # Change working directory
-        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+class RenderLoop:
+    """Render loop shared by the clocks of one process.
 
-        if is_raspberrypi():
-            from display.ws2812b import WS2812B
+    MQTT messages and settings changes are applied on the render thread,
+    and a clock is only rendered when it is due or an event marked it dirty.
+    """
 
-            self.display = WS2812B(DISPLAY_WIDTH, DISPLAY_HEIGTH)
-        else:
-            from display.computer import Computer
+    def __init__(self, config):
+        self.clocks = []
 
-            self.display = Computer(DISPLAY_WIDTH, DISPLAY_HEIGTH, 5, 50)
+        # Sleep until a clock is due or an event marks one dirty
+        self.scheduler = FrameScheduler()
 
-        # Sources
-        self.source = ClockPlugin(DISPLAY_HEIGTH, DISPLAY_HEIGTH)
-        self.display.brightness = 1
+        # MQTT messages are applied on the render thread, coalesced per topic
+        self.messages = MessageQueue()
+        self.messages.on_message = self.scheduler.mark_dirty
 
-    # The callback for when the client receives a CONNACK response from the server.
-    def on_mqtt_connect(self, client, userdata, flags, rc):
-        print("Connected with result code " + str(rc))
+        # Changes to the settings file are applied on the render thread
+        self.watcher = None
+        if config.path is not None:
+            self.watcher = ConfigWatcher(config.path)
+            self.watcher.on_change = self.scheduler.mark_dirty
 
-        # Subscribe to topics from the display
-        for topic in self.display.topics:
-            client.subscribe(topic)
+        self.client = None
+        self.running = False
 
-        # Subscribe to topics from plugins
-        for topic in self.source.topics:
-            client.subscribe(topic)
+    def add(self, clock):
+        """Render a clock in this loop."""
+        self.clocks.append(clock)
 
-        # Add callback for the display
-        client.message_callback_add(
-            self.display.subscription_filter, self.display.callback
-        )
+    # The callback for when the client receives a CONNACK response from the server.
+    def on_mqtt_connect(self, client, userdata, flags, rc):
+        print("Connected with result code " + str(rc))
 
-        # Add callback for plugins using filter
-        client.message_callback_add(
-            self.source.subscription_filter, self.source.callback
-        )
+        for clock in self.clocks:
+            clock.subscribe(client, self.messages)
 
     # The callback for when a PUBLISH message is received from the server.
     def on_mqtt_message(self, client, userdata, msg):
         print(msg.topic + " " + str(msg.payload))
 
     def mainloop(self):
-        # Prepare and start loading resources
+        # Light up the clocks before loading the remaining resources
+        now = time.monotonic()
+        for clock in self.clocks:
+            clock.render(now)
 
         # MQTT
+        import paho.mqtt.client as mqtt
+
         client = mqtt.Client()
         client.on_connect = self.on_mqtt_connect
         client.on_message = self.on_mqtt_message
-        client.connect("localhost")
+        # Connect in the background so the first frame does not wait for the broker
+        client.connect_async("localhost")
         client.loop_start()
+        self.client = client
+
+        # Stopping the service ends the loop like stop(), so pending writes are flushed
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        self.renderloop()
+
+    def renderloop(self):
+        """Render the clocks which are due until stop() is called."""
+        self.running = True
+
+        # Displays which handle their own events are polled together
+        intervals = [
+            clock.display.poll_interval
+            for clock in self.clocks
+            if clock.display.poll_interval is not None
+        ]
+        poll_interval = min(intervals) if intervals else None
 
-        # Timer
-        clock = pygame.time.Clock()
+        start = time.monotonic()
+        for clock in self.clocks:
+            clock.stats_due = start + clock.stats_interval
 
-        while True:
-            # Update the display buffer
-            self.display.buffer = self.source.buffer
+        # Pending settings and recordings are written however the loop ends
+        try:
+            while self.running:
+                now = time.monotonic()
+                for clock in self.clocks:
+                    clock.metrics.gauge("mqtt_queue_depth", len(self.messages))
+                self.messages.apply(now)
+                if self.watcher is not None and self.watcher.apply():
+                    # Display settings change the shown frame without a new source frame
+                    for clock in self.clocks:
+                        clock.dirty = True
 
-            # Render the frame
-            self.display.show()
+                for clock in self.clocks:
+                    if clock.dirty or now >= clock.due:
+                        clock.render(now)
+                    if now >= clock.stats_due:
+                        clock.publish_stats(self.client)
+                        clock.stats_due = now + clock.stats_interval
 
-            # Limit CPU usage do not go faster than FPS
-            dt = clock.tick(self.source.fps)
+                # Sleep until a clock, its stats or queued messages are due
+                deadline = min(min(clock.due, clock.stats_due) for clock in self.clocks)
+                pending = self.messages.deadline
+                if pending is not None and pending < deadline:
+                    deadline = pending
+                woken = self.scheduler.wait(deadline, self.poll, poll_interval)
 
-            self.source.update(dt)
+                if not woken:
+                    overshoot = time.monotonic() - deadline
+                    for clock in self.clocks:
+                        clock.overshot(overshoot)
+        finally:
+            flush_config()
+            for clock in self.clocks:
+                clock.flush()
+            if self.watcher is not None:
+                self.watcher.stop()
 
-        return
+    def poll(self):
+        """Handle pending events of every display."""
+        for clock in self.clocks:
+            clock.display.poll()
+
+    def stop(self):
+        """Make the render loop return after the current pass."""
+        self.running = False
+        self.scheduler.mark_dirty()
+
+
+class WordClock:
+    """A clock plugin in a compositor, its display and the frame exchange between them.
+
+    A clock created without a loop runs its own. Named clocks, the clocks of
+    host.py, read their settings from their own section and use MQTT topics
+    starting with tidsram/<name>. A display given is used instead of one
+    created for the backend.
+    """
+
+    def __init__(
+        self, config=None, section="tidsram_clock", name=None, backend=None, loop=None, display=None
+    ):
+        # Change working directory
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        config = load_config() if config is None else config
+        trace.mark("config")
+
+        self.config = config
+        self.name = name
+        self.topic_root = "tidsram" if name is None else "tidsram/" + name
+        # Section holding the stats and recording settings of this clock
+        self.settings = "tidsram" if name is None else section
+
+        # Compile or map the layout once, displays and plugins share it
+        width = config.getint(section, "width", fallback=DISPLAY_WIDTH)
+        height = config.getint(section, "height", fallback=DISPLAY_HEIGTH)
+        load_layout(
+            config.get(section, "layout", fallback=config.get("tidsram_display", "layout")),
+            width,
+            height,
+        )
+        trace.mark("layout")
+
+        if display is None:
+            # Display options are only passed when set, the backend has its own defaults
+            options = {}
+            if config.has_option(section, "host"):
+                options["host"] = config.get(section, "host")
+            if config.has_option(section, "port"):
+                options["port"] = config.getint(section, "port")
+            if config.has_option(section, "device"):
+                options["device"] = config.get(section, "device")
+            backend = backend or config.get(section, "backend", fallback="") or display_backend(config)
+            display = create_display(backend, width, height, config, **options)
+        self.display = display
+        self.display.topic_root = self.topic_root
+        trace.mark("display")
+
+        # Sources, heavy plugin dependencies are only loaded when used
+        from plugins.clock import ClockPlugin
+        from plugins.compositor import Compositor, Layer
+
+        # Further plugins are added as layers on top of the clock
+        self.clock = ClockPlugin(width, height, section, config)
+        self.source = Compositor(width, height, [Layer(self.clock)], self.topic_root)
+        self.display.brightness = 1
+        trace.mark("plugin")
+
+        # Complete frames are handed from the source to the display through here
+        self.frames = FrameExchange(self.display.buffer.shape)
+        self.shown_sequence = 0
+
+        # Monotonic time of the last and the next render, rendered early when marked dirty
+        self.last = None
+        self.due = 0.0
+        self.dirty = True
+        self.interval = None
+
+        # Runtime metrics, published on <topic root>/stats every stats_interval seconds
+        self.metrics = Metrics()
+
+        # Optional ring file of the frames handed to the display
+        self.recorder = None
+
+        self.config_changed()
+        self.stats_due = time.monotonic() + self.stats_interval
+        config.subscribe(self.config_changed, "tidsram", self.settings)
+
+        # Render only when the source can change or an event marks it dirty
+        self.loop = RenderLoop(config) if loop is None else loop
+        self.loop.add(self)
+        self.source.on_change = self.mark_dirty
+
+    def config_changed(self, changed=None):
+        """Read the stats and recording settings of the clock."""
+        self.stats_interval = self.config.getfloat(
+            self.settings,
+            "stats_interval",
+            fallback=self.config.getfloat("tidsram", "stats_interval", fallback=60.0),
+        )
+        self.prometheus_file = self.config.get(self.settings, "prometheus_file", fallback="")
+
+        record_file = self.config.get(self.settings, "record_file", fallback="")
+        record_frames = self.config.getint(self.settings, "record_frames", fallback=RECORD_FRAMES)
+        if not record_file:
+            self.recorder = None
+        elif (
+            self.recorder is None
+            or self.recorder.path != record_file
+            or self.recorder.capacity != record_frames
+        ):
+            # A recording which cannot be opened keeps the previous one
+            try:
+                self.recorder = FrameRecorder(
+                    record_file, self.display.width, self.display.height, record_frames
+                )
+            except OSError as e:
+                print("Could not record to {}: {}".format(record_file, e))
+
+    @property
+    def messages(self):
+        return self.loop.messages
+
+    def mark_dirty(self):
+        """Render the clock on the next pass of the loop, can be called from any thread."""
+        self.dirty = True
+        self.loop.scheduler.mark_dirty()
+
+    def subscribe(self, client, messages):
+        """Subscribe to the topics of the display and the source."""
+        for topic in self.display.topics + self.source.topics:
+            client.subscribe(topic)
+
+        # Messages are applied on the render thread, the clock is rendered after them
+        client.message_callback_add(
+            self.display.subscription_filter,
+            messages.wrap(self.__dirty_after(self.display.callback)),
+        )
+        client.message_callback_add(
+            self.source.subscription_filter,
+            messages.wrap(self.__dirty_after(self.source.callback)),
+        )
+
+    def __dirty_after(self, callback):
+        def wrapper(client, userdata, msg):
+            callback(client, userdata, msg)
+            self.dirty = True
+
+        return wrapper
+
+    def mainloop(self):
+        self.loop.mainloop()
+
+    def renderloop(self):
+        """Render frames until stop() is called."""
+        self.loop.renderloop()
+
+    def render(self, now=None):
+        """Update the source, show one frame and schedule the next."""
+        now = time.monotonic() if now is None else now
+        dt = 0 if self.last is None else int((now - self.last) * 1000)
+        self.last = now
+        self.dirty = False
+
+        start = time.perf_counter()
+        self.source.update(dt)
+        updated = time.perf_counter()
+        # The exchange owns the buffer the frame is drawn into, so a frame
+        # the display still shows is never written
+        self.source.draw(self.frames.back)
+        self.frames.publish()
+
+        # Update the display buffer with the newest complete frame
+        self.shown_sequence, self.display.buffer = self.frames.acquire()
+        if self.recorder is not None:
+            self.recorder.record(self.shown_sequence, self.display.buffer)
+        handed = time.perf_counter()
+
+        # Render the frame
+        self.display.show()
+        trace.first_frame()
+        shown = time.perf_counter()
+
+        self.metrics.observe("update", updated - start)
+        self.metrics.observe("handoff", handed - updated)
+        self.metrics.observe("show", shown - handed)
+        self.metrics.increment("frames")
+
+        # Sleep until the source can change, do not go faster than FPS,
+        # the display can ask for frames while the power limit recovers or for
+        # its periodic full frames
+        self.interval = self.source.next_update()
+        settle = self.display.next_update()
+        if settle is not None and (self.interval is None or settle < self.interval):
+            self.interval = settle
+        self.due = math.inf if self.interval is None else now + self.interval
+
+    def overshot(self, overshoot):
+        """Count how late the loop woke up, in seconds."""
+        self.metrics.observe("tick_overshoot", overshoot)
+        if self.interval and overshoot > self.interval:
+            self.metrics.increment("dropped_frames", int(overshoot / self.interval))
+
+    def publish_stats(self, client):
+        """Publish the metrics over MQTT and write the optional Prometheus file."""
+        if self.clock.transitions is not None:
+            self.metrics.gauge("transition_dropped_frames", self.clock.transitions.dropped)
+        if self.display.power_limiter is not None:
+            self.metrics.gauge("power_estimate_ma", self.display.power_limiter.estimate)
+            self.metrics.gauge("power_scale", self.display.power_limiter.scale)
+
+        if client is not None:
+            client.publish(self.topic_root + "/stats", self.metrics.to_json())
+
+        if self.prometheus_file:
+            try:
+                write_atomic(self.prometheus_file, self.metrics.to_prometheus())
+            except OSError as e:
+                print("Could not write {}: {}".format(self.prometheus_file, e))
+
+    def flush(self):
+        """Write the recorded frames to their file."""
+        if self.recorder is not None:
+            self.recorder.flush()
+
+    def stop(self):
+        """Make the render loop return after the current pass."""
+        self.loop.stop()
 
 
 # Function declarations
 
 
+def display_backend(config=None):
+    """Get the display backend name from the environment or settings.conf."""
+    backend = os.environ.get("TIDSRAM_DISPLAY")
+    if not backend:
+        config = load_config() if config is None else config
+        backend = config.get("tidsram_display", "backend", fallback="auto")
+
+    if backend == "auto":
+        backend = "ws2812b" if is_raspberrypi() else "computer"
+    return backend
+
+
+def create_display(backend, width=DISPLAY_WIDTH, height=DISPLAY_HEIGTH, config=None, **options):
+    """Create the display for a backend name: ws2812b, spi, computer, memory or ddp.
+
+    Options are passed on to the backend, e.g. host and port for ddp.
+    Backends reading settings use config, the shared configuration when None.
+    """
+    if backend == "ws2812b":
+        from display.ws2812b import WS2812B
+
+        return WS2812B(width, height, config=config, **options)
+    elif backend == "spi":
+        from display.spi import SPI
+
+        return SPI(width, height, config=config, **options)
+    elif backend == "computer":
+        from display.computer import Computer
+
+        return Computer(width, height, 5, 50, config=config, **options)
+    elif backend == "memory":
+        from display.memory import Memory
+
+        return Memory(width, height, **options)
+    elif backend == "ddp":
+        from display.ddp import DDP
+
+        return DDP(width, height, config=config, **options)
+
+    raise ValueError("Unknown display backend: {}".format(backend))
+
+
 def is_raspberrypi():
     try:
         with io.open("/sys/firmware/devicetree/base/model", "r") as m:
@@ -110,7 +432,8 @@ def is_raspberrypi():
 
 # Main body
 if __name__ == "__main__":
-    wordclock = WordClock()
-    wordclock.display.show()
+    if "--trace-startup" in sys.argv:
+        trace.enabled = True
 
+    wordclock = WordClock()
     wordclock.mainloop()
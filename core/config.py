@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import configparser
+import io
+import os
+import threading
+import time
+
+# Parsed configuration files, shared by every module
+_loaded = {}
+
+# Seconds between checks of the configuration file for changes
+WATCH_INTERVAL = 1.0
+
+# Stamp of the last file each ConfigWriter wrote, watchers skip these changes
+_written = {}
+_written_lock = threading.Lock()
+
+
+def load_config(path="settings.conf"):
+    """Get the parsed configuration, the file is only read the first time."""
+    config = _loaded.get(path)
+    if config is None:
+        config = Config(path)
+        config.read(path)
+        _loaded[path] = config
+    return config
+
+
+def parse_color(value):
+    """Parse a color string such as #FFF or red into an rgb tuple."""
+    # PIL is only loaded once a color is parsed
+    from PIL import ImageColor
+
+    return ImageColor.getcolor(value, "RGB")
+
+
+class Config(configparser.ConfigParser):
+    """Configuration shared by the application, with getcolor() and change subscribers.
+
+    Subscribers are called with the set of (section, key) pairs which
+    changed in the sections they subscribed to, and read the new values
+    from the config. The path is the file changes are saved to, None for a
+    config which is never written.
+    """
+
+    def __init__(self, path=None):
+        super().__init__(converters={"color": parse_color})
+        self.path = path
+        self._subscribers = []
+
+    def subscribe(self, callback, *sections):
+        """Call callback with the changed keys of the given sections, all sections if none are given."""
+        self._subscribers.append((callback, set(sections)))
+
+    def unsubscribe(self, callback):
+        self._subscribers = [s for s in self._subscribers if s[0] != callback]
+
+    def items_by_key(self):
+        """Get the raw value of every (section, key) pair."""
+        return {
+            (section, key): value
+            for section in self.sections()
+            for key, value in self.items(section, raw=True)
+        }
+
+    def merge(self, other):
+        """Take the values of another config and notify the subscribers, returns the changed keys."""
+        before = self.items_by_key()
+        after = other.items_by_key()
+        changed = {key for key in before.keys() | after.keys() if before.get(key) != after.get(key)}
+        if not changed:
+            return changed
+
+        for section, key in changed:
+            if (section, key) not in after:
+                self.remove_option(section, key)
+                continue
+            if not self.has_section(section):
+                self.add_section(section)
+            self.set(section, key, after[(section, key)])
+        for section in self.sections():
+            if not other.has_section(section):
+                self.remove_section(section)
+
+        for callback, sections in list(self._subscribers):
+            keys = {(section, key) for section, key in changed if not sections or section in sections}
+            if keys:
+                # A subscriber failing on a bad or missing setting must not stop the render loop
+                try:
+                    callback(keys)
+                except Exception as e:
+                    print("Invalid setting in {}: {!r}".format(sorted(keys), e))
+        return changed
+
+
+class ConfigWatcher:
+    """Reload the configuration when its file changes.
+
+    A background thread checks the modification time of the file and parses
+    a changed file. The new values are merged into the shared config, and
+    the subscribers notified, on the thread calling apply(), so the render
+    thread never reads a half applied change.
+    """
+
+    def __init__(self, path="settings.conf", interval=WATCH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.config = load_config(path)
+        self.on_change = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stamp = self.__stamp()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def __stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def __run(self):
+        while not self._stopped.wait(self.interval):
+            with _written_lock:
+                stamp = self.__stamp()
+                written = _written.get(os.path.abspath(self.path))
+            if stamp is None or stamp == self._stamp:
+                continue
+            self._stamp = stamp
+
+            # The application's own changes are already in the config, and
+            # reloading them could revert a newer change not written yet
+            if stamp == written:
+                continue
+
+            config = Config()
+            try:
+                config.read(self.path)
+            except configparser.Error as e:
+                print("Could not reload {}: {}".format(self.path, e))
+                continue
+            # A file caught while an editor truncated it is picked up on its next change
+            if not config.sections():
+                continue
+            with self._lock:
+                self._pending = config
+
+            # Wake the render loop so it can apply the change
+            if self.on_change is not None:
+                self.on_change()
+
+    def apply(self):
+        """Merge a reloaded file into the config, returns the changed keys."""
+        with self._lock:
+            config = self._pending
+            self._pending = None
+        if config is None:
+            return set()
+        return self.config.merge(config)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class ConfigWriter:
+    """Write configuration changes from a background thread.
+
+    Changes within the delay are batched into one write, and the file is
+    replaced atomically so a power cut never leaves a partial file.
+    """
+
+    def __init__(self, path="settings.conf", delay=2.0):
+        self.path = path
+        self.delay = delay
+        self._content = None
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def save(self, config):
+        """Schedule writing the configuration, takes a snapshot right away."""
+        content = io.StringIO()
+        config.write(content)
+        with self._lock:
+            self._content = content.getvalue()
+        self._changed.set()
+
+    def flush(self):
+        """Write a pending change now."""
+        with self._lock:
+            content = self._content
+            self._content = None
+        if content is not None:
+            with _written_lock:
+                _written[os.path.abspath(self.path)] = write_atomic(self.path, content)
+
+    def __run(self):
+        while True:
+            self._changed.wait()
+            # Let further changes arrive before writing
+            time.sleep(self.delay)
+            self._changed.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print("Could not write {}: {}".format(self.path, e))
+
+
+# Writers of configuration files, shared by every module
+_writers = {}
+
+
+def save_config(config, path=None):
+    """Write the configuration in the background, by default to the file it was loaded from."""
+    path = config.path if path is None else path
+    if path is None:
+        return
+    writer = _writers.get(path)
+    if writer is None:
+        writer = _writers[path] = ConfigWriter(path)
+    writer.save(config)
+
+
+def flush_config():
+    """Write all pending configuration changes now."""
+    for writer in _writers.values():
+        writer.flush()
+
+
+def write_atomic(path, content):
+    """Replace a file through a synced temporary file in the same directory.
+
+    Returns the modification time in nanoseconds and the size of the new file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+        stat = os.fstat(f.fileno())
+    os.replace(temporary, path)
+
+    # Make the rename itself durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return stat.st_mtime_ns, stat.st_size
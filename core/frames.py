@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import threading
+import numpy as np
+
+
+class FrameExchange:
+    """Triple buffered frame handoff between a producer and a consumer thread.
+
+    The producer publishes a complete frame into the back slot and swaps it
+    with the middle slot. The consumer swaps the middle slot into the front
+    when it holds a newer frame. Swaps only exchange slot indexes, frames
+    are never copied, and the lock only guards the index swap so neither
+    side waits while the other renders or shows a frame.
+
+    A published frame must not be modified afterwards. Producers either
+    publish arrays they no longer write to, or draw into back and call
+    publish() without a frame.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+
+        # Writable buffer owned by each slot, and the frame each slot holds
+        self._buffers = [np.zeros(self.shape, dtype=np.uint8) for _ in range(3)]
+        self._frames = list(self._buffers)
+        self._sequences = [0, 0, 0]
+
+        self._front = 0
+        self._middle = 1
+        self._back = 2
+        self._fresh = False
+        self._lock = threading.Lock()
+
+        self.published = 0
+
+    @property
+    def back(self):
+        """Buffer the producer can draw the next frame into before publish()."""
+        return self._buffers[self._back]
+
+    def publish(self, frame=None):
+        """Make a complete frame available to the consumer, returns its sequence number."""
+        if frame is None:
+            frame = self._buffers[self._back]
+        elif frame.shape != self.shape or frame.dtype != np.uint8:
+            raise ValueError(
+                "Frame must be uint8 with shape {}, got {} {}".format(
+                    self.shape, frame.dtype, frame.shape
+                )
+            )
+
+        self.published += 1
+        self._frames[self._back] = frame
+        self._sequences[self._back] = self.published
+
+        with self._lock:
+            self._back, self._middle = self._middle, self._back
+            self._fresh = True
+
+        return self.published
+
+    def acquire(self):
+        """Get the sequence number and frame of the newest published frame."""
+        with self._lock:
+            if self._fresh:
+                self._front, self._middle = self._middle, self._front
+                self._fresh = False
+            front = self._front
+
+        return self._sequences[front], self._frames[front]
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import bisect
+import functools
+import hashlib
+import json
+import os
+import numpy as np
+
+# Color group used for words which do not declare one in the layout
+DEFAULT_GROUP = "on"
+
+# Compiled layouts are cached here, relative to the working directory
+CACHE_DIRECTORY = ".cache/layouts"
+
+# Compiled layout file format
+MAGIC = b"TIDSLAY1"
+ALIGNMENT = 64
+
+# Phrases kept by the cache of a word index
+PHRASE_CACHE_SIZE = 256
+
+# Layouts already loaded by this process, shared by every module
+_loaded = {}
+
+
+class Layout:
+    """Layout words compiled into LED spans, pixel masks and color groups."""
+
+    def __init__(self, width, height, characters, groups, spans, group_ids, masks):
+        self.width = width
+        self.height = height
+        self.number_of_pixels = self.height * self.width
+
+        # Character at every pixel, empty where no word is placed
+        self.characters = characters
+        self.groups = groups
+
+        # Color group of every pixel, pixels outside words belong to the default group
+        self.group_ids = group_ids
+
+        # One boolean pixel mask per word, in the order of spans
+        self.masks = masks
+
+        self._word_index = None
+
+        self.spans = spans
+        self.words = {}
+        self.word_ids = {}
+        for word_id, (category, name, start, length) in enumerate(spans):
+            indexes = np.arange(start, start + length, dtype=np.intp)
+            indexes.flags.writeable = False
+            self.words[(category, name)] = indexes
+            self.word_ids[(category, name)] = word_id
+
+    @classmethod
+    def compile(cls, layout, width=12, height=12):
+        """Compile a parsed layout json document."""
+        number_of_pixels = width * height
+        characters = np.full(number_of_pixels, "", dtype="<U1")
+        groups = [DEFAULT_GROUP]
+        spans = []
+        group_ids = np.zeros(number_of_pixels, dtype=np.intp)
+
+        for category in layout:
+            for name in layout[category]:
+                entry = layout[category][name]
+                word = entry["word"]
+                index = int(entry["index"])
+                if index < 0 or index + len(word) > number_of_pixels:
+                    raise ValueError(
+                        "Word {}/{} does not fit a {}x{} display".format(
+                            category, name, width, height
+                        )
+                    )
+
+                group = entry.get("group", DEFAULT_GROUP)
+                if group not in groups:
+                    groups.append(group)
+
+                spans.append((category, name, index, len(word)))
+                group_ids[index : index + len(word)] = groups.index(group)
+                characters[index : index + len(word)] = list(word)
+
+        masks = np.zeros((len(spans), number_of_pixels), dtype=bool)
+        for word_id, (_, _, start, length) in enumerate(spans):
+            masks[word_id, start : start + length] = True
+
+        for array in (characters, group_ids, masks):
+            array.flags.writeable = False
+        return cls(width, height, characters, groups, spans, group_ids, masks)
+
+    @classmethod
+    def from_json(cls, path, width=12, height=12):
+        """Read and compile a layout from a json file."""
+        with open(path, encoding="utf-8") as f:
+            return cls.compile(json.load(f), width, height)
+
+    def save(self, path):
+        """Write the compiled layout to a file which can be memory mapped by load()."""
+        header = json.dumps(
+            {
+                "width": self.width,
+                "height": self.height,
+                "groups": self.groups,
+                "spans": self.spans,
+            }
+        ).encode("utf-8")
+        offset = _align(len(MAGIC) + 4 + len(header))
+
+        # Write to a temporary file first so a reader never maps a partial file
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            for array in (self.characters, self.group_ids, self.masks):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(np.ascontiguousarray(array).tobytes())
+                offset = _align(f.tell())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """Memory map a layout written by save()."""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a compiled layout".format(path))
+            length = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(length).decode("utf-8"))
+
+        width = header["width"]
+        height = header["height"]
+        number_of_pixels = width * height
+        spans = [tuple(span) for span in header["spans"]]
+
+        arrays = []
+        offset = _align(len(MAGIC) + 4 + length)
+        for dtype, shape in (
+            ("<U1", (number_of_pixels,)),
+            (np.intp, (number_of_pixels,)),
+            (bool, (len(spans), number_of_pixels)),
+        ):
+            array = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+            arrays.append(array)
+            offset = _align(offset + array.nbytes)
+
+        characters, group_ids, masks = arrays
+        return cls(width, height, characters, header["groups"], spans, group_ids, masks)
+
+    def indexes(self, *words):
+        """Get the LED indexes of one or more (category, name) words."""
+        if not words:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([self.words[word] for word in words])
+
+    def mask(self, *words):
+        """Get a boolean pixel mask of one or more (category, name) words."""
+        return self.masks[[self.word_ids[word] for word in words]].any(axis=0)
+
+    def group_mask(self, group):
+        """Get a boolean pixel mask of all pixels in a color group."""
+        return self.group_ids == self.groups.index(group)
+
+    @property
+    def word_index(self):
+        """Index of the text on the layout, built on first use."""
+        if self._word_index is None:
+            self._word_index = WordIndex(self)
+        return self._word_index
+
+
+def load_layout(path, width=12, height=12):
+    """Get the compiled layout of a layout json file.
+
+    Compiled layouts are cached on disk keyed by a hash of the json content
+    and shared between every caller in the process.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    key = (digest, width, height)
+
+    layout = _loaded.get(key)
+    if layout is not None:
+        return layout
+
+    artifact = os.path.join(
+        CACHE_DIRECTORY, "{}-{}x{}.layout".format(digest, width, height)
+    )
+    try:
+        layout = Layout.load(artifact)
+    except (OSError, ValueError):
+        layout = Layout.compile(json.loads(content.decode("utf-8")), width, height)
+        try:
+            os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+            layout.save(artifact)
+        except OSError:
+            print("Could not cache compiled layout {}".format(artifact))
+
+    _loaded[key] = layout
+    return layout
+
+
+class WordIndex:
+    """Find the LED spans spelling a word or phrase on a layout, in reading order.
+
+    Every piece of text in a horizontal run of letters, which includes the
+    declared words, maps to the LED index where it starts, so a word is
+    found with one dict lookup. Words not on the layout are spelled with
+    single letters instead.
+    """
+
+    def __init__(self, layout, cache_size=PHRASE_CACHE_SIZE):
+        self.layout = layout
+        characters = [character.upper() for character in layout.characters.tolist()]
+
+        occurrences = {}
+        for row in range(layout.height):
+            first = row * layout.width
+            end = first + layout.width
+            run = first
+            for index in range(first, end + 1):
+                if index < end and characters[index] != "":
+                    continue
+                # Every text within the run of letters ending here
+                for start in range(run, index):
+                    text = ""
+                    for character in characters[start:index]:
+                        text += character
+                        occurrences.setdefault(text, []).append(start)
+                run = index + 1
+
+        # Start indexes of each text in reading order
+        self.occurrences = {text: tuple(starts) for text, starts in occurrences.items()}
+
+        self.spell = functools.lru_cache(maxsize=cache_size)(self.__spell)
+
+    def __find(self, text, position):
+        """Get the first start index of text at or after position, None if there is none."""
+        starts = self.occurrences.get(text, ())
+        found = bisect.bisect_left(starts, position)
+        return starts[found] if found < len(starts) else None
+
+    def __spell(self, phrase):
+        """Get the (start, length) LED spans spelling phrase, None if it can not be spelled."""
+        spans = []
+        position = 0
+        for word in phrase.upper().split():
+            start = self.__find(word, position)
+            if start is not None:
+                spans.append((start, len(word)))
+                position = start + len(word)
+                continue
+
+            for character in word:
+                start = self.__find(character, position)
+                if start is None:
+                    return None
+                spans.append((start, 1))
+                position = start + 1
+        return tuple(spans)
+
+    def indexes(self, phrase):
+        """Get the LED indexes spelling phrase, None if it can not be spelled."""
+        spans = self.spell(phrase)
+        if spans is None:
+            return None
+        if not spans:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([np.arange(start, start + length, dtype=np.intp) for start, length in spans])
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class WordRenderer:
+    """Render lit words into a display buffer using the layout color groups."""
+
+    def __init__(self, layout):
+        self.layout = layout
+        self._palette = np.zeros((len(layout.groups), 3), dtype=np.uint8)
+
+    def palette(self, colors):
+        """Set the color of each group from a dict of group name to rgb."""
+        for group, color in colors.items():
+            if group in self.layout.groups:
+                self._palette[self.layout.groups.index(group)] = color
+
+    def render(self, buffer, indexes, off_color):
+        """Fill the buffer with the off color and paint the indexes in their group color."""
+        pixels = buffer.reshape(-1, 3)
+        pixels[:] = off_color
+        pixels[indexes] = self._palette[self.layout.group_ids[indexes]]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+# Seconds to collect messages before the latest value of each topic is applied
+COALESCE_WINDOW = 0.05
+
+
+class MessageQueue:
+    """Collect MQTT messages from the network thread and apply them on the render thread.
+
+    Only the latest message of each topic is kept, so a burst of messages
+    from e.g. a color slider is applied once.
+    """
+
+    def __init__(self, window=COALESCE_WINDOW):
+        self.window = window
+        self.on_message = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._since = None
+
+    def put(self, callback, client, userdata, msg):
+        """Queue a message, replacing any pending message on the same topic."""
+        with self._lock:
+            first = not self._pending
+            self._pending[msg.topic] = (callback, client, userdata, msg)
+            if first:
+                self._since = time.monotonic()
+
+        # Wake the render loop so it can schedule applying the messages
+        if first and self.on_message is not None:
+            self.on_message()
+
+    def wrap(self, callback):
+        """Get an MQTT callback which queues messages for callback."""
+
+        def wrapper(client, userdata, msg):
+            self.put(callback, client, userdata, msg)
+
+        return wrapper
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def deadline(self):
+        """Monotonic time when the pending messages are due, None when empty."""
+        since = self._since
+        return None if since is None else since + self.window
+
+    def apply(self, now=None):
+        """Run the callbacks of the pending messages if they are due, returns True if any ran."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._since is None or now < self._since + self.window:
+                return False
+            pending = self._pending
+            self._pending = {}
+            self._since = None
+
+        for callback, client, userdata, msg in pending.values():
+            callback(client, userdata, msg)
+        return True
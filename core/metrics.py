@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import json
+import numpy as np
+
+# Samples kept per histogram
+HISTOGRAM_SIZE = 1024
+
+PERCENTILES = (50, 95, 99)
+
+
+class RingHistogram:
+    """Fixed size ring buffer of the most recent samples of one measurement."""
+
+    def __init__(self, size=HISTOGRAM_SIZE):
+        self._samples = np.zeros(size, dtype=np.float64)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self._samples[self.count % len(self._samples)] = value
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        """Get count, sum, max and percentiles over the samples in the ring."""
+        samples = self._samples[: min(self.count, len(self._samples))]
+        summary = {"count": self.count, "sum": self.total}
+        if len(samples):
+            for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+                summary["p{}".format(percentile)] = float(value)
+            summary["max"] = float(samples.max())
+        return summary
+
+
+class Metrics:
+    """Runtime measurements of the render loop: histograms, counters and gauges."""
+
+    def __init__(self, prefix="tidsram"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value):
+        """Add a sample, in seconds for durations, to a histogram."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RingHistogram()
+        histogram.add(value)
+
+    def increment(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        return {
+            "histograms": {
+                name: histogram.summary() for name, histogram in self.histograms.items()
+            },
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """Format the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, histogram in self.histograms.items():
+            metric = "{}_{}_seconds".format(self.prefix, name)
+            summary = histogram.summary()
+            lines.append("# TYPE {} summary".format(metric))
+            for percentile in PERCENTILES:
+                key = "p{}".format(percentile)
+                if key in summary:
+                    lines.append(
+                        '{}{{quantile="{}"}} {}'.format(metric, percentile / 100, summary[key])
+                    )
+            lines.append("{}_sum {}".format(metric, summary["sum"]))
+            lines.append("{}_count {}".format(metric, summary["count"]))
+        for name, value in self.counters.items():
+            metric = "{}_{}_total".format(self.prefix, name)
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+        for name, value in self.gauges.items():
+            metric = "{}_{}".format(self.prefix, name)
+            lines.append("# TYPE {} gauge".format(metric))
+            lines.append("{} {}".format(metric, value))
+        return "\n".join(lines) + "\n"
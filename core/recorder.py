@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import numpy as np
+
+# Recording file format
+MAGIC = b"TIDSREC1"
+ALIGNMENT = 64
+
+# Frames kept by a recording before the oldest are overwritten
+RECORD_FRAMES = 9000
+
+HEADER = np.dtype(
+    [
+        ("magic", "S8"),
+        ("width", "<u4"),
+        ("height", "<u4"),
+        ("capacity", "<u8"),
+        ("count", "<u8"),
+    ]
+)
+
+
+def record_dtype(width, height):
+    """Get the dtype of one recorded frame."""
+    return np.dtype(
+        [
+            ("sequence", "<u8"),
+            ("time", "<f8"),
+            ("frame", "u1", (height, width, 3)),
+        ]
+    )
+
+
+class FrameRecorder:
+    """Keep the most recent frames in a fixed size ring file.
+
+    The file is memory mapped, so recording a frame is a copy into memory
+    and the kernel writes the pages back in the background. The count in
+    the header is updated after the frame, so a reader never sees a frame
+    that was only partly written. An existing recording of the same size is
+    continued, which keeps the frames shown before a restart.
+    """
+
+    def __init__(self, path, width=12, height=12, capacity=RECORD_FRAMES, mode="r+"):
+        self.path = path
+        offset = (HEADER.itemsize + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+        if mode == "r":
+            self.header = np.memmap(path, dtype=HEADER, mode="r", shape=(1,))
+            if self.header["magic"][0] != MAGIC:
+                raise ValueError("{} is not a frame recording".format(path))
+            width = int(self.header["width"][0])
+            height = int(self.header["height"][0])
+            capacity = int(self.header["capacity"][0])
+        else:
+            dtype = record_dtype(width, height)
+            size = offset + dtype.itemsize * capacity
+            if not self.__matches(path, width, height, capacity, size):
+                with open(path, "wb") as f:
+                    f.truncate(size)
+                header = np.memmap(path, dtype=HEADER, mode="r+", shape=(1,))
+                header[0] = (MAGIC, width, height, capacity, 0)
+                header.flush()
+                del header
+            self.header = np.memmap(path, dtype=HEADER, mode="r+", shape=(1,))
+
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.records = np.memmap(
+            path, dtype=record_dtype(width, height), mode=mode, offset=offset, shape=(capacity,)
+        )
+
+        # Field views, so recording a frame does not look up the fields
+        self._sequences = self.records["sequence"]
+        self._times = self.records["time"]
+        self._frames = self.records["frame"]
+        self._count = self.header["count"]
+
+    @staticmethod
+    def __matches(path, width, height, capacity, size):
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            header = np.fromfile(path, dtype=HEADER, count=1)[0]
+        except (OSError, IndexError):
+            return False
+        return (
+            header["magic"] == MAGIC
+            and header["width"] == width
+            and header["height"] == height
+            and header["capacity"] == capacity
+        )
+
+    @property
+    def count(self):
+        """Number of frames recorded, including the ones overwritten since."""
+        return int(self._count[0])
+
+    def record(self, sequence, frame):
+        """Append a frame with its sequence number and the current time."""
+        count = int(self._count[0])
+        slot = count % self.capacity
+        np.copyto(self._frames[slot], frame)
+        self._sequences[slot] = sequence
+        self._times[slot] = time.time()
+        self._count[0] = count + 1
+
+    def frames(self):
+        """Get the recorded frames, oldest first, as a structured array with sequence, time and frame."""
+        count = self.count
+        first = max(count - self.capacity, 0)
+        order = np.arange(first, count) % self.capacity
+        return self.records[order]
+
+    def flush(self):
+        """Write the recorded frames to the file now."""
+        self.records.flush()
+        self.header.flush()
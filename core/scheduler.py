@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+
+class FrameScheduler:
+    """Sleep until the next frame is due or until something marks the state dirty."""
+
+    def __init__(self):
+        self._dirty = threading.Event()
+
+    def mark_dirty(self):
+        """Wake the render loop, can be called from any thread."""
+        self._dirty.set()
+
+    def wait(self, deadline=None, poll=None, poll_interval=None):
+        """Block until the monotonic deadline has passed or the state is marked dirty.
+
+        A deadline of None waits for the next dirty mark only. When a poll
+        function is given it is called at least every poll_interval seconds
+        while waiting, which lets a display handle its own events.
+        Returns True when woken because the state was marked dirty.
+        """
+        while True:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            if poll_interval is not None:
+                timeout = poll_interval if timeout is None else min(timeout, poll_interval)
+
+            if self._dirty.wait(timeout):
+                self._dirty.clear()
+                return True
+
+            if poll is not None:
+                poll()
+
+        return False
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+
+def process_start_time():
+    """Get the wall clock time the process was started, falls back to now."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces, the fields after it do not
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat") as f:
+            boot_time = next(
+                int(line.split()[1]) for line in f if line.startswith("btime")
+            )
+        return boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+class StartupTrace:
+    """Record named steps from process start until the first frame is shown."""
+
+    def __init__(self):
+        self.enabled = bool(os.environ.get("TIDSRAM_TRACE_STARTUP"))
+        self.started = process_start_time()
+        self.marks = []
+        self.reported = False
+
+    def mark(self, name):
+        """Record that the step name has finished."""
+        self.marks.append((name, time.time()))
+
+    def first_frame(self):
+        """Record the first frame and print the report when tracing is enabled."""
+        if self.reported:
+            return
+        self.mark("first frame")
+        self.reported = True
+        if self.enabled:
+            print(self.report())
+
+    def report(self):
+        lines = ["Startup trace"]
+        previous = self.started
+        for name, moment in self.marks:
+            lines.append("  {:<12} {:8.1f} ms".format(name, (moment - previous) * 1000))
+            previous = moment
+        lines.append("  {:<12} {:8.1f} ms".format("total", (previous - self.started) * 1000))
+        return "\n".join(lines)
+
+
+# Shared by every module
+trace = StartupTrace()
@@ -2,7 +2,10 @@
 
 import abc
 import numpy as np
-import time
+from display.power import LED_CHANNEL_MA, PowerLimiter
+
+# Offset of each rgb channel in the flattened lookup table
+CHANNEL_OFFSETS = np.array([0, 256, 512], dtype=np.intp)
 
 
 class AbstractDisplay(abc.ABC):
@@ -11,7 +14,31 @@ class AbstractDisplay(abc.ABC):
         self.height = height
         self.number_of_pixels = self.height * self.width
         self._buffer = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self._canvas = self._buffer
         self._brightness = 1.0
+        self._gamma = 1.0
+        self._white_balance = (255, 255, 255)
+
+        # Per channel lookup table combining gamma, white balance and brightness
+        self._lut = None
+        # Indexes are kept as intp and the offsets spelled out per pixel,
+        # otherwise numpy allocates conversion buffers on every frame
+        self._lut_index = np.empty(self._buffer.shape, dtype=np.intp)
+        self._lut_offsets = np.broadcast_to(CHANNEL_OFFSETS, self._buffer.shape).copy()
+        self._output = np.empty(self._buffer.shape, dtype=np.uint8)
+        self.build_lut()
+
+        # Keeps the current drawn by the LEDs within a budget, None when unlimited
+        self.power_limiter = None
+
+        # Root of the MQTT topics the display subscribes to
+        self.topic_root = "tidsram"
+
+        # Seconds between calls to poll() while the render loop is idle
+        self.poll_interval = None
+
+        # Direction of every other row of a serpentine wired LED strip
+        self.reverse_mirror = False
 
     @property
     def buffer(self):
@@ -20,32 +47,93 @@ class AbstractDisplay(abc.ABC):
 
     @buffer.setter
     def buffer(self, value):
-        if isinstance(value, np.ndarray):
-            if self._buffer.shape == value.shape:
-                self._buffer = value
+        if not isinstance(value, np.ndarray) or value.dtype != np.uint8:
+            raise TypeError("Display buffer must be a uint8 numpy array")
+        if self._buffer.shape != value.shape:
+            raise ValueError(
+                "Display buffer must have shape {}, got {}".format(
+                    self._buffer.shape, value.shape
+                )
+            )
+        self._buffer = value
 
     def clear_buffer(self):
-        """Erase the buffer and fill it with zeros."""
-        self._buffer = np.zeros_like(self._buffer)
+        """Erase the buffer and fill it with zeros.
+
+        The display owns one writable buffer, a frame assigned to buffer is
+        replaced by it rather than overwritten.
+        """
+        self._canvas.fill(0)
+        self._buffer = self._canvas
 
     @abc.abstractmethod
-    def show(self, gamma=False):
+    def show(self):
         """Display the content of the buffer."""
 
+    def build_lut(self):
+        """Rebuild the lookup table after the gamma, white balance or brightness changed."""
+        levels = (np.arange(256) / 255.0) ** self._gamma * self._brightness
+        trim = np.array(self._white_balance, dtype=np.float64).reshape(3, 1)
+        lut = (trim * levels + 0.5).astype(np.uint8)
+
+        # Swapping the reference is atomic, show() never sees a half built table
+        self._lut = lut.ravel()
+
+    def output_buffer(self):
+        """Get the buffer with the lookup table applied, valid until the next call."""
+        np.copyto(self._lut_index, self._buffer)
+        np.add(self._lut_index, self._lut_offsets, out=self._lut_index)
+        np.take(self._lut, self._lut_index, out=self._output, mode="clip")
+        if self.power_limiter is not None:
+            self.power_limiter.apply(self._output)
+        return self._output
+
+    def load_color_settings(self, config):
+        """Read gamma and white balance from the tidsram_display section."""
+        self.gamma = config.getfloat("tidsram_display", "gamma", fallback=1.0)
+        self.white_balance = config.getcolor(
+            "tidsram_display", "white_balance", fallback=(255, 255, 255)
+        )
+
+    def load_power_settings(self, config, gain=1.0):
+        """Limit the LED current to power_budget mA of the tidsram_display section, 0 is unlimited.
+
+        The gain is a brightness the LEDs apply after the frame is sent.
+        """
+        budget = config.getfloat("tidsram_display", "power_budget", fallback=0.0)
+        if budget <= 0:
+            self.power_limiter = None
+            return
+        self.power_limiter = PowerLimiter(
+            self._output.shape,
+            budget,
+            config.getfloat("tidsram_display", "led_current", fallback=LED_CHANNEL_MA),
+            gain=gain,
+        )
+
+    def next_update(self):
+        """Seconds until the display should be shown again without a new frame, None if not needed."""
+        if self.power_limiter is not None:
+            return self.power_limiter.next_update()
+        return None
+
+    def poll(self):
+        """Handle pending display events while the render loop is idle."""
+
     @property
     def topics(self):
         """Get an array of of topics which the display driver accepts"""
-        return ["tidsram/display/brightness"]
+        return [self.topic_root + "/display/brightness"]
 
     @property
     def subscription_filter(self):
         """Topic filter used to trigger the callback method"""
-        return "tidsram/display/#"
+        return self.topic_root + "/display/#"
 
     def callback(self, client, userdata, msg):
         """Method which should be called when a topic is updated which matches the subscription filter"""
         try:
-            if msg.topic == "tidsram/display/brightness":
+            if msg.topic == self.topic_root + "/display/brightness":
                 self.brightness = float(msg.payload.decode("utf-8"))
         except ValueError as ve:
             print("Invalid brightness value")
@@ -63,29 +151,126 @@ class AbstractDisplay(abc.ABC):
             self._brightness = 0
         else:
             self._brightness = value
+        self.build_lut()
+
+    @property
+    def gamma(self):
+        """Get the gamma correction exponent, 1.0 disables the correction."""
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, value):
+        self._gamma = max(float(value), 0.1)
+        self.build_lut()
+
+    @property
+    def white_balance(self):
+        """Get the rgb color shown for full white, trims the color temperature."""
+        return self._white_balance
+
+    @white_balance.setter
+    def white_balance(self, color):
+        self._white_balance = tuple(color)
+        self.build_lut()
+
+    def get_led_index(self, x, y):
+        """Determines if the row is even or odd and returns a new index based on X and Y"""
+        pos = 0
+        if self.reverse_mirror:
+            if x & 0x1:
+                pos = (
+                    (self.height * (self.height - x))
+                    - self.height
+                    + (self.height - 1 - y)
+                )
+            else:
+                pos = (self.height * (self.height - x)) - self.height + y
+        else:
+            if x & 0x1:
+                pos = x * self.height + (self.height - 1 - y)
+            else:
+                pos = x * self.height + y
+
+        return pos
+
+    def led_order(self):
+        """Get the buffer pixel shown at each LED index, the serpentine wiring as a permutation."""
+        led_indexes = np.array(
+            [
+                self.get_led_index(i, j)
+                for i in range(self.height)
+                for j in range(self.width)
+            ],
+            dtype=np.intp,
+        )
+        return np.argsort(led_indexes)
+
+    def writable_buffer(self):
+        """Get the buffer owned by the display, holding the current frame, for drawing into."""
+        if self._buffer is not self._canvas:
+            np.copyto(self._canvas, self._buffer)
+            self._buffer = self._canvas
+        return self._canvas
 
     def set_pixel_at_index(self, index, color):
-        if (index < 0) or (index > self.number_of_pixels):
+        if (index < 0) or (index >= self.number_of_pixels):
             return
-        index *= 3
-        self._buffer.put([index, index + 1, index + 2], color)
+        self.writable_buffer().reshape(-1, 3)[index] = color
 
     def set_pixel_at_coord(self, x, y, color):
         if (x < 0) or (x >= self.width) or (y < 0) or (y >= self.height):
             return
-        self._buffer[y, x] = color
+        self.writable_buffer()[y, x] = color
+
+    def set_pixels_at_indexes(self, indexes, colors):
+        """Set the pixels at an array of indexes to one color or an array of colors.
+
+        Indexes outside of the display are skipped.
+        """
+        indexes = np.asarray(indexes, dtype=np.intp).reshape(-1)
+        colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        inside = (indexes >= 0) & (indexes < self.number_of_pixels)
+        if len(colors) > 1:
+            colors = colors[inside]
+        self.writable_buffer().reshape(-1, 3)[indexes[inside]] = colors
+
+    def set_pixels_at_coords(self, xs, ys, colors):
+        """Set the pixels at arrays of x and y coordinates to one color or an array of colors.
+
+        Coordinates outside of the display are skipped.
+        """
+        xs = np.asarray(xs, dtype=np.intp).reshape(-1)
+        ys = np.asarray(ys, dtype=np.intp).reshape(-1)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        self.set_pixels_at_indexes(
+            np.where(inside, ys * self.width + xs, -1), colors
+        )
 
     def set_buffer_with_flat_values(self, rgb_values):
-        rgb_values = np.array(rgb_values, dtype=np.uint8)
-        rgb_values.resize((self.number_of_pixels * 3,), refcheck=False)
-        rgb_values = rgb_values.reshape(self.height, self.width, 3)
-        self._buffer = rgb_values
+        """Fill the buffer with flat rgb values, padded with zeros or cut to the display size."""
+        rgb_values = np.asarray(rgb_values, dtype=np.uint8).reshape(-1)
+        flat = self.writable_buffer().reshape(-1)
+        count = min(len(rgb_values), len(flat))
+        flat[:count] = rgb_values[:count]
+        flat[count:] = 0
+
+    def load_frame(self, data):
+        """Show a frame from any buffer protocol object holding height * width * 3 rgb bytes.
+
+        The frame is used in place without copying, so the memory must stay
+        valid and unchanged until another frame is loaded.
+        """
+        frame = np.frombuffer(data, dtype=np.uint8)
+        if frame.size != self.number_of_pixels * 3:
+            raise ValueError(
+                "Frame must hold {} bytes, got {}".format(self.number_of_pixels * 3, frame.size)
+            )
+        self._buffer = frame.reshape(self._canvas.shape)
 
     def create_test_pattern(self):
         self.clear_buffer()
-        number_of_leds = self.width * self.height
-        for i in range(number_of_leds):
-            self.set_pixel_at_index(i % self.number_of_pixels, self.wheel(i))
+        indexes = np.arange(self.number_of_pixels)
+        self.set_pixels_at_indexes(indexes, wheel_colors(indexes))
 
     def wheel(self, pos):
         """Input a value 0 to 255 to get a color value. The colours are a transition r - g - b - back to r"""
@@ -99,21 +284,14 @@ class AbstractDisplay(abc.ABC):
         pos -= 170
         return (pos * 3, 0, 255 - pos * 3)
 
-    def run_benchmark(self, gamma=False):
-        total = 0
-        repeat = self.number_of_pixels * 10
-        for i in range(repeat):
-            start = time.time()
-            self.set_pixel_at_index(i % self.number_of_pixels, (255, 255, 255))
-            self.show(gamma)
-            self.clear_buffer()
-            end = time.time()
-            diff = end - start
-            total = total + diff
-        print(
-            "{:.2f}s for {} iterations. {:d} refreshs per second".format(
-                total, repeat, int(repeat / total)
-            )
-        )
-        self.clear_buffer()
-        self.show()
+
+def wheel_colors(positions):
+    """Get the wheel() colors of an array of positions as an (N, 3) uint8 array."""
+    positions = np.asarray(positions, dtype=np.intp).reshape(-1)
+    colors = np.zeros((len(positions), 3), dtype=np.uint8)
+    for start, end, rising, falling in ((0, 85, 1, 0), (85, 170, 2, 1), (170, 256, 0, 2)):
+        inside = (positions >= start) & (positions < end)
+        ramp = (positions[inside] - start) * 3
+        colors[inside, rising] = ramp
+        colors[inside, falling] = 255 - ramp
+    return colors
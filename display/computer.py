@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
-import configparser
 import sys
 import pygame
 import random
-import json
+import numpy as np
+from collections import OrderedDict
 
 from display.abstract_display import AbstractDisplay
+from core.config import load_config
+from core.layout import load_layout
 from array import *
 
 # Colors
@@ -17,9 +19,12 @@ GRAY = (100, 100, 100)
 DARKGRAY = (20, 20, 20)
 WHITE = (255, 255, 255)
 
+# Number of rendered glyph surfaces kept in memory
+GLYPH_CACHE_SIZE = 512
+
 
 class Computer(AbstractDisplay):
-    def __init__(self, width=12, height=12, margin=5, size=50):
+    def __init__(self, width=12, height=12, margin=5, size=50, config=None):
         super().__init__(width, height)
 
         self.margin = margin
@@ -34,34 +39,79 @@ class Computer(AbstractDisplay):
         pygame.font.init()
 
         self.section = "tidsram_computer"
-        self.config = configparser.ConfigParser()
-        self.config.read("settings.conf")
+        self.config = load_config() if config is None else config
 
         self.fill_empty = self.config.getboolean(self.section, "fill_empty")
         self.show_index = self.config.getboolean(self.section, "show_index")
+        self.load_color_settings(self.config)
 
         # Load fonts
         self.index_font = pygame.font.SysFont("arial", 12)
         self.char_font = pygame.font.Font("fonts/D-DINExp-Bold.ttf", self.size)
 
-        # Prepare word list
-        self.words = []
-        for i in range(self.width * self.height):
-            self.words.append("")
-
         # Load layout
-        layout = self.config.get("tidsram_display", "layout")
-        f = open(layout, encoding="utf-8")
-        layout = json.load(f)
-
-        # Read layout words
-        for category in layout:
-            for words in layout[category]:
-                word = layout[category][words]["word"]
-                index = int(layout[category][words]["index"])
-                for char in word:
-                    self.words[index] = char
-                    index += 1
+        self.layout = load_layout(
+            self.config.get("tidsram_display", "layout"), self.width, self.height
+        )
+
+        # Rendered glyphs keyed by character and displayed color
+        self.glyphs = OrderedDict()
+
+        # Create the window
+        self.surface = pygame.display.set_mode(self.window_size)
+        pygame.display.set_caption("tidsram {}x{}".format(width, height))
+        self.poll_interval = 0.1
+
+        # Static grid and index labels, drawn once
+        self.background = pygame.Surface(self.window_size)
+        self.draw_background()
+
+        # Colors currently drawn in the window
+        self.shown = np.zeros(self.buffer.shape, dtype=np.uint8)
+        self._differs = np.empty(self.buffer.shape, dtype=bool)
+        self._changed = np.empty(self.buffer.shape[:2], dtype=bool)
+        self.redraw = True
+        self.show()
+
+        self.config.subscribe(self.config_changed, self.section, "tidsram_display")
+
+    def draw_background(self):
+        """Draw the grid and the index labels behind the characters."""
+        self.background.fill(BLACK)
+        for i in range(self.height):
+            for j in range(self.width):
+                pygame.draw.rect(self.background, DARKGRAY, self.cell_rect(i, j))
+                if self.show_index:
+                    index_as_img = self.index_font.render(
+                        str(i * self.width + j), True, WHITE
+                    )
+                    self.background.blit(index_as_img, self.cell_rect(i, j))
+        self.surface.blit(self.background, (0, 0))
+        self.redraw = True
+
+    def config_changed(self, changed):
+        """Apply changed settings of the tidsram_computer and tidsram_display sections."""
+        keys = {key for _, key in changed}
+        if keys & {"gamma", "white_balance"}:
+            self.load_color_settings(self.config)
+        if keys & {"layout", "fill_empty"}:
+            self.fill_empty = self.config.getboolean(self.section, "fill_empty")
+            self.layout = load_layout(
+                self.config.get("tidsram_display", "layout"), self.width, self.height
+            )
+        if "show_index" in keys:
+            self.show_index = self.config.getboolean(self.section, "show_index")
+            self.draw_background()
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @layout.setter
+    def layout(self, layout):
+        """Show the characters of another layout, redrawn on the next show()."""
+        self._layout = layout
+        self.words = layout.characters.tolist()
 
         # Add random letters to empty slots
         if self.fill_empty:
@@ -70,70 +120,74 @@ class Computer(AbstractDisplay):
                     uppercase = "ABCDEFGHIJKLMNOPQRSTUVXYZ"
                     self.words[i] = random.choice(uppercase)
 
-        # Create the window
-        self.surface = pygame.display.set_mode(self.window_size)
-        pygame.display.set_caption("tidsram {}x{}".format(width, height))
-        self.show()
+        self.redraw = True
 
-    def show(self, gamma=False):
+    def cell_rect(self, i, j):
+        """Get the window rectangle of the cell at row i and column j."""
+        return pygame.Rect(
+            (self.margin + self.size) * j + self.margin,
+            (self.margin + self.size) * i + self.margin,
+            self.size,
+            self.size,
+        )
+
+    def glyph(self, character, color):
+        """Get a rendered character from the cache, rendering it on a miss."""
+        key = (character, color)
+        surface = self.glyphs.get(key)
+        if surface is None:
+            surface = self.char_font.render(character, True, color)
+            self.glyphs[key] = surface
+            if len(self.glyphs) > GLYPH_CACHE_SIZE:
+                self.glyphs.popitem(last=False)
+        else:
+            self.glyphs.move_to_end(key)
+        return surface
+
+    def poll(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
-        index = 0
-        for j in range(self.width):
-            for i in range(self.height):
-                color = self.buffer[i][j] * self.brightness
-
-                # Draw background color and border
-                pygame.draw.rect(
-                    self.surface,
-                    DARKGRAY,
-                    [
-                        (self.margin + self.size) * j + self.margin,
-                        (self.margin + self.size) * i + self.margin,
-                        self.size,
-                        self.size,
-                    ],
-                )
-
-                # Draw characters from words array
-                character = self.char_font.render(
-                    self.words[i * self.width + j], True, color
-                )
-                self.surface.blit(
-                    character,
-                    [
-                        (self.margin + self.size) * j + self.margin * 3,
-                        (self.margin + self.size) * i + self.margin,
-                        self.size,
-                        self.size,
-                    ],
-                )
-
-                # Draw index number of current character
-                if self.show_index:
-                    index_as_img = self.index_font.render(
-                        str(i * self.width + j), True, WHITE
-                    )
-                    self.surface.blit(
-                        index_as_img,
-                        [
-                            (self.margin + self.size) * j + self.margin,
-                            (self.margin + self.size) * i + self.margin,
-                            self.size,
-                            self.size,
-                        ],
-                    )
 
-        pygame.display.update()
+    def show(self):
+        self.poll()
+
+        colors = self.output_buffer()
+        if self.redraw:
+            changed = np.ndindex(self.height, self.width)
+        else:
+            np.not_equal(colors, self.shown, out=self._differs)
+            np.any(self._differs, axis=2, out=self._changed)
+            if not self._changed.any():
+                return
+            changed = np.argwhere(self._changed).tolist()
+
+        rects = []
+        for i, j in changed:
+            rect = self.cell_rect(i, j)
+
+            # Restore the background and draw the character within its cell
+            self.surface.set_clip(rect)
+            self.surface.blit(self.background, rect, rect)
+            character = self.glyph(
+                self.words[i * self.width + j], tuple(colors[i, j].tolist())
+            )
+            self.surface.blit(character, (rect.x + self.margin * 2, rect.y))
+            rects.append(rect)
+
+        self.surface.set_clip(None)
+        np.copyto(self.shown, colors)
+        self.redraw = False
+
+        if rects:
+            pygame.display.update(rects)
 
         return
 
 
 if __name__ == "__main__":
     display = Computer()
-    # display.run_benchmark()
     display.create_test_pattern()
     display.show()
     import time
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import socket
+import struct
+import time
+import numpy as np
+from display.abstract_display import AbstractDisplay
+from core.config import load_config
+
+# Distributed Display Protocol, http://www.3waylabs.com/ddp/
+DDP_PORT = 4048
+DDP_VERSION = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB8 = 0x0B
+DDP_DESTINATION = 0x01
+DDP_HEADER = struct.Struct(">BBBBIH")
+DDP_SEQUENCES = 15
+
+# Largest pixel payload in one packet, 480 rgb pixels fits a 1500 byte MTU
+MAX_PIXELS = 480
+
+# Changed runs closer than this are sent together, a header costs about three pixels
+MERGE_GAP = 4
+
+# Seconds between full frames, lets receivers recover from lost packets
+KEYFRAME_INTERVAL = 5.0
+
+
+def changed_runs(pixels, previous):
+    """Get (start, end) pixel ranges which differ between two flat rgb frames."""
+    changed = np.flatnonzero((pixels != previous).any(axis=1))
+    if len(changed) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(changed) > MERGE_GAP)
+    starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+    ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+class DDP(AbstractDisplay):
+    """Stream frames to a network LED controller with the DDP protocol over UDP.
+
+    Only the pixel ranges that changed since the previous frame are sent,
+    with a full frame every few seconds. The last packet of a frame sets
+    the push flag so the receiver shows complete frames only.
+    """
+
+    def __init__(self, width=16, height=16, host=None, port=None, config=None):
+        super().__init__(width, height)
+
+        self.config = load_config() if config is None else config
+        self.section = "tidsram_ddp"
+        self.host = host or self.config.get(self.section, "host", fallback="127.0.0.1")
+        self.port = port or self.config.getint(self.section, "port", fallback=DDP_PORT)
+        self.load_color_settings(self.config)
+
+        # Addresses given by the caller are not replaced by settings.conf
+        self.fixed_address = host is not None or port is not None
+        self.config.subscribe(self.config_changed, self.section, "tidsram_display")
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sequence = 0
+        self.packets = 0
+
+        self._sent = np.zeros((self.number_of_pixels, 3), dtype=np.uint8)
+        self._keyframe = 0.0
+
+    def config_changed(self, changed):
+        """Apply changed colors, stream to a changed host or port starting with a full frame."""
+        keys = {key for _, key in changed}
+        if keys & {"gamma", "white_balance"}:
+            self.load_color_settings(self.config)
+        if self.fixed_address or not keys & {"host", "port"}:
+            return
+        self.host = self.config.get(self.section, "host", fallback="127.0.0.1")
+        self.port = self.config.getint(self.section, "port", fallback=DDP_PORT)
+        self._keyframe = 0.0
+
+    def next_update(self):
+        """Seconds until the next full frame is due, or the power limit sooner."""
+        keyframe = max(self._keyframe + KEYFRAME_INTERVAL - time.monotonic(), 0.0)
+        settle = super().next_update()
+        if settle is not None and settle < keyframe:
+            return settle
+        return keyframe
+
+    def show(self):
+        pixels = self.output_buffer().reshape(-1, 3)
+
+        now = time.monotonic()
+        if now - self._keyframe >= KEYFRAME_INTERVAL:
+            runs = [(0, self.number_of_pixels)]
+            self._keyframe = now
+        else:
+            runs = changed_runs(pixels, self._sent)
+        if not runs:
+            return
+
+        # Split long runs to fit the packet size
+        packets = []
+        for start, end in runs:
+            for offset in range(start, end, MAX_PIXELS):
+                packets.append((offset, min(offset + MAX_PIXELS, end)))
+
+        self.sequence = self.sequence % DDP_SEQUENCES + 1
+        for number, (start, end) in enumerate(packets):
+            flags = DDP_VERSION
+            if number == len(packets) - 1:
+                flags |= DDP_PUSH
+            data = pixels[start:end].tobytes()
+            header = DDP_HEADER.pack(
+                flags, self.sequence, DDP_TYPE_RGB8, DDP_DESTINATION, start * 3, len(data)
+            )
+            self.socket.sendto(header + data, (self.host, self.port))
+        self.packets += len(packets)
+
+        np.copyto(self._sent, pixels)
+
+
+if __name__ == "__main__":
+    display = DDP(12, 12, "127.0.0.1")
+    display.create_test_pattern()
+    display.show()
+    print("Sent {} packet(s) to {}:{}".format(display.packets, display.host, display.port))
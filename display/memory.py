@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from display.abstract_display import AbstractDisplay
+
+
+class Memory(AbstractDisplay):
+    """Headless display which keeps the last shown frames in memory."""
+
+    def __init__(self, width=16, height=16, history=60):
+        super().__init__(width, height)
+
+        self.frame_count = 0
+        self.history = history
+        self._frames = np.zeros((history, height, width, 3), dtype=np.uint8)
+
+    def show(self):
+        """Store a copy of the corrected buffer in the frame history."""
+        np.copyto(self._frames[self.frame_count % self.history], self.output_buffer())
+        self.frame_count += 1
+
+    def last_frames(self, count=None):
+        """Get up to count of the most recently shown frames, oldest first."""
+        available = min(self.frame_count, self.history)
+        count = available if count is None else min(count, available)
+        order = np.arange(self.frame_count - count, self.frame_count) % self.history
+        return self._frames[order]
+
+    @property
+    def last_frame(self):
+        """Get the most recently shown frame, None before the first show()."""
+        if self.frame_count == 0:
+            return None
+        return self._frames[(self.frame_count - 1) % self.history]
+
+
+if __name__ == "__main__":
+    display = Memory()
+    display.create_test_pattern()
+    display.show()
+    print("{} frame(s) shown".format(display.frame_count))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import math
+import time
+import numpy as np
+
+# Current of one WS2812B color channel at full intensity, in mA
+LED_CHANNEL_MA = 20.0
+
+# Current of one WS2812B with all channels off, in mA
+LED_IDLE_MA = 1.0
+
+# Seconds for the scale to get most of the way back, 1 - 1/e, once frames fit the budget
+RELEASE_TIME = 0.5
+
+# Seconds between frames while the scale comes back
+RELEASE_INTERVAL = 0.05
+
+
+class PowerLimiter:
+    """Scale frames down so the LEDs stay within a current budget.
+
+    The current of a frame is estimated from the channel values with one
+    dot product. A frame over the budget is scaled down right away, so the
+    supply is never overloaded, while the scale returns over time once
+    frames fit again so a blinking pixel does not make the display pump.
+    The return depends on the time since the previous frame, not on the
+    number of frames, since frames may be minutes apart.
+    """
+
+    def __init__(self, shape, budget, channel_ma=LED_CHANNEL_MA, idle_ma=LED_IDLE_MA, gain=1.0):
+        self.budget = budget
+        self.idle = idle_ma * shape[0] * shape[1]
+
+        # Current of each channel value, gain is a brightness applied after the frame
+        self._weights = np.full(shape, channel_ma * gain / 255, dtype=np.float32).reshape(-1)
+        self._scratch = np.empty(shape, dtype=np.float32)
+        self._flat = self._scratch.reshape(-1)
+
+        self.scale = 1.0
+        self.target = 1.0
+        self.estimate = self.idle
+        self.applied = time.monotonic()
+
+    def apply(self, frame, now=None):
+        """Scale a uint8 frame in place, returns the estimated current in mA before scaling."""
+        now = time.monotonic() if now is None else now
+        np.copyto(self._scratch, frame)
+        self.estimate = self.idle + float(np.dot(self._flat, self._weights))
+
+        if self.estimate > self.budget:
+            self.target = max(self.budget - self.idle, 0.0) / (self.estimate - self.idle)
+        else:
+            self.target = 1.0
+        if self.target < self.scale:
+            self.scale = self.target
+        else:
+            release = 1.0 - math.exp(-(now - self.applied) / RELEASE_TIME)
+            self.scale += (self.target - self.scale) * release
+            if self.scale > self.target - 0.001:
+                self.scale = self.target
+        self.applied = now
+
+        if self.scale < 1.0:
+            np.multiply(self._scratch, self.scale, out=self._scratch)
+            np.copyto(frame, self._scratch, casting="unsafe")
+        return self.estimate
+
+    def next_update(self):
+        """Seconds until the next frame should be shown, None unless the scale is coming back."""
+        if self.scale < self.target:
+            return RELEASE_INTERVAL
+        return None
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import stat
+import numpy as np
+from display.abstract_display import AbstractDisplay
+from core.config import load_config
+
+# SPI clock, every SPI byte is one 1.25 us WS2812 bit at 6.4 MHz
+SPI_SPEED_HZ = 6400000
+
+# SPI bytes for a WS2812 one and zero bit, the high time is 0.78 us and 0.31 us
+BIT_ONE = 0xF8
+BIT_ZERO = 0xC0
+
+# Zero bytes latching the frame, 280 us low for newer WS2812B revisions
+RESET_BYTES = 224
+
+# spidev ioctl setting the maximum transfer speed, _IOW('k', 4, __u32)
+SPI_IOC_WR_MAX_SPEED_HZ = 0x40046B04
+
+# Order of the channels on the wire
+WIRE_ORDER = np.array([1, 0, 2], dtype=np.intp)
+
+
+def build_bit_lut():
+    """Get the 8 SPI bytes encoding each color byte, most significant bit first."""
+    bits = (np.arange(256)[:, np.newaxis] >> np.arange(7, -1, -1)) & 1
+    return np.where(bits, BIT_ONE, BIT_ZERO).astype(np.uint8)
+
+
+# Color byte to SPI bytes
+BIT_LUT = build_bit_lut()
+
+
+class SPI(AbstractDisplay):
+    """WS2812B strip driven by the MOSI pin of a spidev device, no root or DMA needed."""
+
+    def __init__(self, width=16, height=16, device=None, config=None, create=False):
+        """Init the display, create makes a missing device a regular file, for testing without the LEDs."""
+        super().__init__(width, height)
+
+        self.config = load_config() if config is None else config
+        self.section = "tidsram_display"
+
+        self.led_brightness = self.config.getint(self.section, "brightness")
+        self.reverse_mirror = self.config.getboolean(self.section, "reverse_mirror")
+        self.load_color_settings(self.config)
+        self.load_power_settings(self.config)
+
+        # Byte of the corrected buffer sent at each position of the strip, in wire order
+        self.byte_order = self.wire_order()
+
+        # The whole bitstream is encoded in place, the reset tail stays zero
+        self._wire = np.empty(self.number_of_pixels * 3, dtype=np.uint8)
+        self._wire_index = np.empty(self.number_of_pixels * 3, dtype=np.intp)
+        self._stream = np.zeros(self.number_of_pixels * 3 * 8 + RESET_BYTES, dtype=np.uint8)
+        self._bits = self._stream[: self.number_of_pixels * 3 * 8].reshape(-1, 8)
+
+        # A regular file instead of a device is rewritten from the start every frame
+        self.device = device or self.config.get("tidsram_spi", "device", fallback="/dev/spidev0.0")
+        try:
+            self.fd = os.open(self.device, os.O_WRONLY | (os.O_CREAT if create else 0), 0o644)
+        except FileNotFoundError as e:
+            raise FileNotFoundError(
+                "No SPI device {}, is SPI enabled?".format(self.device)
+            ) from e
+        self.seekable = stat.S_ISREG(os.fstat(self.fd).st_mode)
+        if not self.seekable:
+            speed = self.config.getint("tidsram_spi", "speed", fallback=SPI_SPEED_HZ)
+            fcntl.ioctl(self.fd, SPI_IOC_WR_MAX_SPEED_HZ, speed.to_bytes(4, "little"))
+
+        self.config.subscribe(self.config_changed, self.section)
+
+    def wire_order(self):
+        """Get the byte of the corrected buffer sent at each position of the bitstream."""
+        return (self.led_order()[:, np.newaxis] * 3 + WIRE_ORDER).ravel()
+
+    def config_changed(self, changed):
+        """Apply changed settings of the tidsram_display section."""
+        keys = {key for _, key in changed}
+        if "brightness" in keys:
+            self.led_brightness = self.config.getint(self.section, "brightness")
+            self.build_lut()
+        if keys & {"gamma", "white_balance"}:
+            self.load_color_settings(self.config)
+        if keys & {"power_budget", "led_current"}:
+            self.load_power_settings(self.config)
+        if "reverse_mirror" in keys:
+            self.reverse_mirror = self.config.getboolean(self.section, "reverse_mirror")
+            self.byte_order = self.wire_order()
+
+    def build_lut(self):
+        """Apply the brightness limit of settings.conf on top of the color lookup table."""
+        super().build_lut()
+        limit = getattr(self, "led_brightness", 255)
+        if limit < 255:
+            self._lut = (self._lut.astype(np.uint16) * limit // 255).astype(np.uint8)
+
+    def show(self):
+        """Encode the corrected buffer into the WS2812 bitstream and write it in one call"""
+        np.take(self.output_buffer().reshape(-1), self.byte_order, out=self._wire, mode="clip")
+        np.copyto(self._wire_index, self._wire)
+        np.take(BIT_LUT, self._wire_index, axis=0, out=self._bits, mode="clip")
+
+        if self.seekable:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+        os.write(self.fd, self._stream)
+
+    def close(self):
+        """Close the device."""
+        os.close(self.fd)
+
+
+if __name__ == "__main__":
+    display = SPI()
+    display.create_test_pattern()
+    display.show()
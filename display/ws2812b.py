@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
+import ctypes
 import numpy as np
 import sys
 from display.abstract_display import AbstractDisplay
-import configparser
-from rpi_ws281x import *
+from core.config import load_config
 
 # LED strip configuration:
 LED_COUNT = 256  # Number of LED pixels.
@@ -16,72 +16,142 @@ LED_BRIGHTNESS = 64  # Set to 0 for darkest and 255 for brightest
 LED_INVERT = False  # True to invert the signal (when using NPN transistor level shift)
 LED_CHANNEL = 0  # set to '1' for GPIOs 13, 19, 41, 45 or 53
 
+# Bit offset of the red and green channel in the 24-bit color word used by Color()
+RED_SHIFT = 16
+GREEN_SHIFT = 8
+
+
+def led_array(strip, count):
+    """Get the color words of the first count LEDs of a strip as a writable numpy view.
+
+    The view is the LED buffer of the driver's channel, which show() sends,
+    so writing it needs no library call per pixel. The library itself has
+    no bulk setter, a slice assignment calls ws2811_led_set for every pixel.
+    None when the strip does not expose its channel.
+    """
+    try:
+        from rpi_ws281x import ws
+
+        address = int(ws.ws2811_channel_t_leds_get(strip._channel))
+    except (ImportError, AttributeError, TypeError):
+        return None
+    if not address:
+        return None
+    return np.ctypeslib.as_array((ctypes.c_uint32 * count).from_address(address))
+
 
 class WS2812B(AbstractDisplay):
-    def __init__(self, width=16, height=16):
+    def __init__(self, width=16, height=16, config=None, strip=None):
+        """Init the display, strip is an initialized rpi_ws281x strip, created when None."""
         super().__init__(width, height)
 
-        self.config = configparser.ConfigParser()
-        self.config.read("settings.conf")
+        self.config = load_config() if config is None else config
         self.section = "tidsram_display"
 
         self.led_brightness = self.config.getint(self.section, "brightness")
         self.reverse_mirror = self.config.getboolean(
             self.section, "reverse_mirror"
         )
+        self.load_color_settings(self.config)
+        self.load_power_settings(self.config, self.led_brightness / 255)
 
-        # Create NeoPixel object with appropriate configuration.
-        self.strip = Adafruit_NeoPixel(
-            LED_COUNT,
-            LED_PIN,
-            LED_FREQ_HZ,
-            LED_DMA,
-            LED_INVERT,
-            self.led_brightness,
-            LED_CHANNEL,
-            ws.WS2811_STRIP_GRB,
-        )
+        if strip is None:
+            from rpi_ws281x import Adafruit_NeoPixel, ws
+
+            # Create NeoPixel object with appropriate configuration.
+            strip = Adafruit_NeoPixel(
+                LED_COUNT,
+                LED_PIN,
+                LED_FREQ_HZ,
+                LED_DMA,
+                LED_INVERT,
+                self.led_brightness,
+                LED_CHANNEL,
+                ws.WS2811_STRIP_GRB,
+            )
+
+            # Intialize the library (must be called once before other functions).
+            # The configured brightness is a fixed hardware limit, dimming is done by the lookup table
+            strip.begin()
+        self.strip = strip
+
+        # Buffer pixel shown at each LED index
+        self.pixel_order = self.led_order()
+
+        # Colors are written straight into the driver's LED buffer when it is reachable
+        self._leds = led_array(self.strip, self.number_of_pixels)
+
+        # Packed colors in LED order, alternating so the last written colors are kept
+        self._channels = np.empty((self.number_of_pixels, 3), dtype=np.uint32)
+        self._packed = np.empty(self.number_of_pixels, dtype=np.uint32)
+        self._green = np.empty(self.number_of_pixels, dtype=np.uint32)
+        self._colors = [np.empty(self.number_of_pixels, dtype=np.uint32) for _ in range(2)]
+        self._differs = np.empty(self.number_of_pixels, dtype=bool)
+        self._same = np.empty(self.number_of_pixels, dtype=bool)
+        self._indexes = np.arange(self.number_of_pixels, dtype=np.intp)
+        self._slots = np.empty(self.number_of_pixels, dtype=np.intp)
+        # Changed LED indexes, the extra last slot takes the unchanged ones
+        self._changed = np.empty(self.number_of_pixels + 1, dtype=np.intp)
+
+        # Colors last written to the strip, None forces a full write
+        self._strip_colors = None
+
+        self.config.subscribe(self.config_changed, self.section)
+
+    def config_changed(self, changed):
+        """Apply changed settings of the tidsram_display section."""
+        keys = {key for _, key in changed}
+        if keys & {"gamma", "white_balance"}:
+            self.load_color_settings(self.config)
+        if "brightness" in keys:
+            self.led_brightness = self.config.getint(self.section, "brightness")
+            self.strip.setBrightness(self.led_brightness)
+        if keys & {"brightness", "power_budget", "led_current"}:
+            self.load_power_settings(self.config, self.led_brightness / 255)
+        if "reverse_mirror" in keys:
+            self.reverse_mirror = self.config.getboolean(self.section, "reverse_mirror")
+            self.pixel_order = self.led_order()
+        self._strip_colors = None
+
+    def show(self):
+        """Pack the corrected buffer into LED order and write it to the strip"""
+        np.copyto(self._channels, self.output_buffer().reshape(-1, 3))
+        # Shifted and or'ed in place, an integer dot product allocates a temporary
+        np.left_shift(self._channels[:, 0], RED_SHIFT, out=self._packed)
+        np.left_shift(self._channels[:, 1], GREEN_SHIFT, out=self._green)
+        np.bitwise_or(self._packed, self._green, out=self._packed)
+        np.bitwise_or(self._packed, self._channels[:, 2], out=self._packed)
+
+        if self._leds is not None:
+            np.take(self._packed, self.pixel_order, out=self._leds, mode="clip")
+        else:
+            self.__set_changed_pixels()
 
-        # Intialize the library (must be called once before other functions).
-        self.strip.begin()
-
-    def show(self, gamma=False):
-        """Iterate through the buffer and assign each LED index a color from the buffer"""
-        index = 0
-        for j in range(self.width):
-            for i in range(self.height):
-                color = Color(
-                    self.buffer[i][j][0].item(),
-                    self.buffer[i][j][1].item(),
-                    self.buffer[i][j][2].item(),
-                )
-                index = self.get_led_index(i, j)
-                self.strip.setPixelColor(index, color)
-
-        brightness = int(self.led_brightness * self._brightness)
-        self.strip.setBrightness(brightness)
         self.strip.show()
         return
 
-    def get_led_index(self, x, y):
-        """Determines if the row is even or odd and returns a new index based on X and Y"""
-        pos = 0
-        if self.reverse_mirror:
-            if x & 0x1:
-                pos = (
-                    (self.height * (self.height - x))
-                    - self.height
-                    + (self.height - 1 - y)
-                )
-            else:
-                pos = (self.height * (self.height - x)) - self.height + y
+    def __set_changed_pixels(self):
+        """Set the LEDs that changed since the previous frame one call at a time."""
+        colors = self._colors[0] if self._strip_colors is not self._colors[0] else self._colors[1]
+        np.take(self._packed, self.pixel_order, out=colors, mode="clip")
+
+        if self._strip_colors is None:
+            self._differs.fill(True)
         else:
-            if x & 0x1:
-                pos = x * self.height + (self.height - 1 - y)
-            else:
-                pos = x * self.height + y
+            np.not_equal(colors, self._strip_colors, out=self._differs)
+
+        # Gather the changed indexes in place, np.compress allocates its index array.
+        # A changed LED goes to the slot counting the changed LEDs before it.
+        np.copyto(self._slots, self._differs)
+        np.add.accumulate(self._slots, out=self._slots)
+        np.subtract(self._slots, 1, out=self._slots)
+        np.logical_not(self._differs, out=self._same)
+        np.copyto(self._slots, self.number_of_pixels, where=self._same)
+        np.put(self._changed, self._slots, self._indexes)
 
-        return pos
+        for index in self._changed[: np.count_nonzero(self._differs)]:
+            self.strip.setPixelColor(int(index), int(colors[index]))
+        self._strip_colors = colors
 
 
 if __name__ == "__main__":
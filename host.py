@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Runs several word clocks from one process.
+Every [clock:<name>] section of settings.conf is one clock with its own
+layout, timezone, colors and display. Layouts and frame tables are shared
+between clocks with the same settings, the render loop and MQTT client are
+shared between all of them.
+"""
+
+# Imports
+from core.startup import trace
+import os
+import sys
+from core.config import load_config
+from app import RenderLoop, WordClock
+
+trace.mark("import")
+
+# Prefix of the settings.conf sections describing a clock
+SECTION_PREFIX = "clock:"
+
+
+class ClockHost:
+    def __init__(self, config=None):
+        # Change working directory
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+        config = load_config() if config is None else config
+        trace.mark("config")
+
+        # One loop renders every clock, the clocks are the ones app.py runs
+        self.loop = RenderLoop(config)
+        self.clocks = [
+            WordClock(config, section, section[len(SECTION_PREFIX):], loop=self.loop)
+            for section in config.sections()
+            if section.startswith(SECTION_PREFIX)
+        ]
+        if not self.clocks:
+            raise ValueError("No [{}<name>] sections in settings.conf".format(SECTION_PREFIX))
+
+    def mainloop(self):
+        self.loop.mainloop()
+
+    def renderloop(self):
+        """Render the clocks which are due until stop() is called."""
+        self.loop.renderloop()
+
+    def stop(self):
+        """Make the render loop return after the current pass."""
+        self.loop.stop()
+
+
+# Main body
+if __name__ == "__main__":
+    if "--trace-startup" in sys.argv:
+        trace.enabled = True
+
+    host = ClockHost()
+    host.mainloop()
@@ -12,21 +12,44 @@ class AbstractPlugin(abc.ABC):
         self.height = height
         self.number_of_pixels = self.height * self.width
         self._buffer = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self._blank = np.zeros_like(self._buffer)
+        self._blank.flags.writeable = False
         self.fps = 0
+        self.on_change = None
+
+        # Root of the MQTT topics the plugin subscribes to
+        self.topic_root = "tidsram"
 
     @property
     def buffer(self):
-        """The buffer contains the rgb data representation of the source."""
+        """The buffer contains the rgb data representation of the source.
+
+        Buffers are compared by identity to find changed layers, so a plugin
+        must assign a new array instead of modifying a buffer it already returned.
+        """
         return self._buffer
 
+    def draw(self, out):
+        """Copy the buffer into out, e.g. the back buffer of a frame exchange."""
+        np.copyto(out, self.buffer)
+
     def clear_buffer(self):
-        """Clear the source buffer by filling it with zeros."""
-        self._buffer = np.zeros_like(self._buffer)
+        """Clear the source buffer, it is replaced by a shared read-only black frame."""
+        self._buffer = self._blank
 
     @abc.abstractmethod
     def update(self, dt):
         """Update the source by passing current dt."""
 
+    def next_update(self):
+        """Seconds until the buffer may change, None if only an event can change it."""
+        return 1.0 / self.fps if self.fps else None
+
+    def changed(self):
+        """Tell the render loop the buffer changed outside of update()."""
+        if self.on_change is not None:
+            self.on_change()
+
     @abc.abstractproperty
     def topics(self):
         """Get an array of of topics which the plugin accepts"""
@@ -1,20 +1,28 @@
 #!/usr/bin/env python3
 
 # Imports
+import configparser
 import time
+import threading
 import numpy as np
 import datetime
+import weakref
+from zoneinfo import ZoneInfo
 from plugins.abstract import AbstractPlugin
-import json
-import configparser
-from PIL import ImageColor
+from core.config import load_config, parse_color, save_config
+from core.layout import WordRenderer, load_layout
+from plugins.transitions import TRANSITION_FPS, TransitionEngine
+
+# Frame tables in use, shared between clocks with the same layout and colors
+_frame_tables = weakref.WeakValueDictionary()
+_frame_tables_lock = threading.Lock()
+
 
-def indexes(entry):
-    """Words to LED indexes mapping."""
-    word = entry["word"]
-    index = entry["index"]
-    length = len(word)
-    return [*range(index, index + length)]
+def time_range(start, end, step):
+    """Get a numpy datetime64 array of every step from start up to end."""
+    return np.arange(
+        np.datetime64(start, "s"), np.datetime64(end, "s"), np.timedelta64(step)
+    )
 
 
 def rgb2hex(rgb):
@@ -22,12 +30,11 @@ def rgb2hex(rgb):
 
 
 class ClockPlugin(AbstractPlugin):
-    def __init__(self, width=16, height=16):
-        """Init the class"""
+    def __init__(self, width=16, height=16, section="tidsram_clock", config=None):
+        """Init the class, settings missing in section are read from tidsram_clock."""
         super().__init__(width, height)
-        self.config = configparser.ConfigParser()
-        self.config.read("settings.conf")
-        self.section = "tidsram_clock"
+        self.config = load_config() if config is None else config
+        self.section = section
 
         self.fps = 5
 
@@ -42,66 +49,159 @@ class ClockPlugin(AbstractPlugin):
         self.prefix = []
         self.soon = []
         self.signature = []
-        self.simulate = self.config.getboolean(self.section, "simulate")
-        self._on_color = ImageColor.getcolor(self.config.get(self.section, "on_rgb"), "RGB")
-        self._off_color = ImageColor.getcolor(self.config.get(self.section, "off_rgb"), "RGB")
-        self._day_color = ImageColor.getcolor(self.config.get(self.section, "day_rgb"), "RGB")
-        self._signature_color = ImageColor.getcolor(self.config.get(self.section, "signature_rgb"), "RGB")
+        self.simulate = self.config.BOOLEAN_STATES.get(
+            self.setting("simulate", "False").lower(), False
+        )
+        self._on_color = parse_color(self.setting("on_rgb"))
+        self._off_color = parse_color(self.setting("off_rgb"))
+        self._day_color = parse_color(self.setting("day_rgb"))
+        self._signature_color = parse_color(self.setting("signature_rgb"))
+
+        # Local time of the system when no timezone is set
+        timezone = self.setting("timezone", "")
+        self.timezone = ZoneInfo(timezone) if timezone else None
 
+        self._layout = self.__load_layout()
         self.__construct_word_arrays()
 
+        # Animate phrase changes, not used while simulating
+        self._key = None
+        self.transitions = self.__create_transitions()
+
+        # Every frame the clock can show, indexed by the state key
+        self._rebuild_lock = threading.Lock()
+        self._rebuild_pending = False
+        self._rebuild_thread = None
+        # The table is built in the background so the first frame is not delayed
+        self._frames = None
+        self._frames_ready = threading.Event()
+        self.__request_rebuild()
+
+        self.config.subscribe(self.config_changed, self.section, "tidsram_clock", "tidsram_display")
+
+    def setting(self, key, fallback=None):
+        """Get a setting from the plugin section, falling back to tidsram_clock."""
+        value = self.config.get(self.section, key, fallback=None)
+        if value is None:
+            value = self.config.get("tidsram_clock", key, fallback=fallback)
+        return value
+
+    def config_changed(self, changed):
+        """Apply changed settings, only the caches they affect are rebuilt."""
+        keys = {key for _, key in changed}
+
+        # Each color setter requests a rebuild, requests are merged into one
+        for key, name in (
+            ("on_rgb", "on_color"),
+            ("off_rgb", "off_color"),
+            ("day_rgb", "day_color"),
+            ("signature_rgb", "signature_color"),
+        ):
+            if key not in keys:
+                continue
+            # A removed color keeps the previous one
+            value = self.setting(key)
+            if value is not None:
+                color = parse_color(value)
+                if color != getattr(self, name):
+                    setattr(self, name, color)
+
+        if "layout" in keys:
+            # A layout which cannot be loaded keeps the clock on the previous one
+            try:
+                layout = self.__load_layout()
+            except (OSError, ValueError, configparser.Error) as e:
+                print("Could not load layout: {}".format(e))
+                layout = self._layout
+            if layout is not self._layout:
+                self.layout = layout
+        if "timezone" in keys:
+            timezone = self.setting("timezone", "")
+            self.timezone = ZoneInfo(timezone) if timezone else None
+        if "simulate" in keys:
+            self.simulate = self.config.BOOLEAN_STATES.get(
+                self.setting("simulate", "False").lower(), False
+            )
+        if keys & {"simulate", "transition", "transition_duration"}:
+            self.transitions = self.__create_transitions()
+
+        self.changed()
+
+    def __load_layout(self):
+        path = self.setting("layout")
+        if path is None:
+            path = self.config.get("tidsram_display", "layout")
+        return load_layout(path, self.width, self.height)
+
+    def __create_transitions(self):
+        transition = self.setting("transition", "none")
+        if transition == "none" or self.simulate:
+            return None
+        return TransitionEngine(
+            self.width,
+            self.height,
+            transition,
+            float(self.setting("transition_duration", "0.5")),
+        )
+
     def __construct_word_arrays(self):
-        f = open("layouts/swedish3.json", encoding="utf-8")
-        layout = json.load(f)
+        layout = self._layout
+        self.renderer = WordRenderer(layout)
 
-        self.prefix = indexes(layout["prefix"]["she"]) + indexes(layout["prefix"]["is"])
-        self.soon = indexes(layout["prefix"]["soon"])
-        self.signature = indexes(layout["others"]["signature"])
+        self.prefix = layout.indexes(("prefix", "she"), ("prefix", "is"))
+        self.soon = layout.indexes(("prefix", "soon"))
+        self.signature = layout.indexes(("others", "signature"))
 
         self.minutes = [
-            [],
-            indexes(layout["minutes"]["five"]) + indexes(layout["minutes"]["past"]),
-            indexes(layout["minutes"]["ten"]) + indexes(layout["minutes"]["past"]),
-            indexes(layout["minutes"]["quarter"]) + indexes(layout["minutes"]["past"]),
-            indexes(layout["minutes"]["twenty"]) + indexes(layout["minutes"]["past"]),
-            indexes(layout["minutes"]["five"])
-            + indexes(layout["minutes"]["to"])
-            + indexes(layout["minutes"]["half"]),
-            indexes(layout["minutes"]["half"]),
-            indexes(layout["minutes"]["five"])
-            + indexes(layout["minutes"]["past"])
-            + indexes(layout["minutes"]["half"]),
-            indexes(layout["minutes"]["twenty"]) + indexes(layout["minutes"]["to"]),
-            indexes(layout["minutes"]["quarter"]) + indexes(layout["minutes"]["to"]),
-            indexes(layout["minutes"]["ten"]) + indexes(layout["minutes"]["to"]),
-            indexes(layout["minutes"]["five"]) + indexes(layout["minutes"]["to"]),
-            [],
+            layout.indexes(),
+            layout.indexes(("minutes", "five"), ("minutes", "past")),
+            layout.indexes(("minutes", "ten"), ("minutes", "past")),
+            layout.indexes(("minutes", "quarter"), ("minutes", "past")),
+            layout.indexes(("minutes", "twenty"), ("minutes", "past")),
+            layout.indexes(("minutes", "five"), ("minutes", "to"), ("minutes", "half")),
+            layout.indexes(("minutes", "half")),
+            layout.indexes(("minutes", "five"), ("minutes", "past"), ("minutes", "half")),
+            layout.indexes(("minutes", "twenty"), ("minutes", "to")),
+            layout.indexes(("minutes", "quarter"), ("minutes", "to")),
+            layout.indexes(("minutes", "ten"), ("minutes", "to")),
+            layout.indexes(("minutes", "five"), ("minutes", "to")),
+            layout.indexes(),
         ]
         self.hours = [
-            indexes(layout["hours"]["twelve"]),
-            indexes(layout["hours"]["one"]),
-            indexes(layout["hours"]["two"]),
-            indexes(layout["hours"]["three"]),
-            indexes(layout["hours"]["four"]),
-            indexes(layout["hours"]["five"]),
-            indexes(layout["hours"]["six"]),
-            indexes(layout["hours"]["seven"]),
-            indexes(layout["hours"]["eight"]),
-            indexes(layout["hours"]["nine"]),
-            indexes(layout["hours"]["ten"]),
-            indexes(layout["hours"]["eleven"]),
-            indexes(layout["hours"]["twelve"]),
+            layout.indexes(("hours", "twelve")),
+            layout.indexes(("hours", "one")),
+            layout.indexes(("hours", "two")),
+            layout.indexes(("hours", "three")),
+            layout.indexes(("hours", "four")),
+            layout.indexes(("hours", "five")),
+            layout.indexes(("hours", "six")),
+            layout.indexes(("hours", "seven")),
+            layout.indexes(("hours", "eight")),
+            layout.indexes(("hours", "nine")),
+            layout.indexes(("hours", "ten")),
+            layout.indexes(("hours", "eleven")),
+            layout.indexes(("hours", "twelve")),
         ]
         self.weekdays = [
-            indexes(layout["day"]["monday"]),
-            indexes(layout["day"]["tuesday"]),
-            indexes(layout["day"]["wednesday"]),
-            indexes(layout["day"]["thursday"]),
-            indexes(layout["day"]["friday"]),
-            indexes(layout["day"]["saturday"]),
-            indexes(layout["day"]["sunday"]),
+            layout.indexes(("day", "monday")),
+            layout.indexes(("day", "tuesday")),
+            layout.indexes(("day", "wednesday")),
+            layout.indexes(("day", "thursday")),
+            layout.indexes(("day", "friday")),
+            layout.indexes(("day", "saturday")),
+            layout.indexes(("day", "sunday")),
         ]
 
+    @property
+    def layout(self):
+        return self._layout
+
+    @layout.setter
+    def layout(self, layout):
+        self._layout = layout
+        self.__construct_word_arrays()
+        self.__request_rebuild()
+
     @property
     def on_color(self):
         return self._on_color
@@ -109,6 +209,7 @@ class ClockPlugin(AbstractPlugin):
     @on_color.setter
     def on_color(self, color):
         self._on_color = color
+        self.__request_rebuild()
 
     @property
     def off_color(self):
@@ -117,6 +218,7 @@ class ClockPlugin(AbstractPlugin):
     @off_color.setter
     def off_color(self, color):
         self._off_color = color
+        self.__request_rebuild()
 
     @property
     def day_color(self):
@@ -125,6 +227,7 @@ class ClockPlugin(AbstractPlugin):
     @day_color.setter
     def day_color(self, color):
         self._day_color = color
+        self.__request_rebuild()
 
     @property
     def signature_color(self):
@@ -133,50 +236,124 @@ class ClockPlugin(AbstractPlugin):
     @signature_color.setter
     def signature_color(self, color):
         self._signature_color = color
+        self.__request_rebuild()
 
     @property
     def topics(self):
-        return ["tidsram/plugin/clock/on", "tidsram/plugin/clock/off", "tidsram/plugin/clock/day", "tidsram/plugin/clock/signature"]
+        return [
+            self.topic_root + "/plugin/clock/on",
+            self.topic_root + "/plugin/clock/off",
+            self.topic_root + "/plugin/clock/day",
+            self.topic_root + "/plugin/clock/signature",
+        ]
 
     @property
     def subscription_filter(self):
-        return "tidsram/plugin/clock/#"
+        return self.topic_root + "/plugin/clock/#"
 
     def callback(self, client, userdata, msg):
         print("%s %s" % (msg.topic, msg.payload))
 
         try:
-            color = ImageColor.getcolor(msg.payload.decode("utf-8"), "RGB")
-            if msg.topic == "tidsram/plugin/clock/on":
+            color = parse_color(msg.payload.decode("utf-8"))
+            if msg.topic == self.topic_root + "/plugin/clock/on":
                 self.on_color = color
                 self.config.set(self.section, "on_rgb", rgb2hex(self.on_color))
-            elif msg.topic == "tidsram/plugin/clock/off":
+            elif msg.topic == self.topic_root + "/plugin/clock/off":
                 self.off_color = color
                 self.config.set(self.section, "off_rgb", rgb2hex(self.off_color))
-            elif msg.topic == "tidsram/plugin/clock/day":
-                self._day_color = color
+            elif msg.topic == self.topic_root + "/plugin/clock/day":
+                self.day_color = color
                 self.config.set(self.section, "day_rgb", rgb2hex(self.day_color))
-            elif msg.topic == "tidsram/plugin/clock/signature":
-                self._signature_color = color
+            elif msg.topic == self.topic_root + "/plugin/clock/signature":
+                self.signature_color = color
                 self.config.set(self.section, "signature_rgb", rgb2hex(self.signature_color))
+            else:
+                return
         except ValueError as ve:
             print("Invalid RGB value")
+            return
 
-        with open("settings.conf", "w") as configfile:
-            self.config.write(configfile)
+        save_config(self.config)
 
     def update(self, dt):
         """Update the source. Checks current time and refreshes the internal buffer."""
         hour, minute, second, weekday = (
             self.__getCurrentTime() if not self.simulate else self.__getSimulateTime()
         )
-        self._buffer = self.__construct_buffer(hour, minute, second, weekday)
+        key = self.__state(hour, minute, weekday)
+
+        frames = self._frames
+        if frames is None:
+            # The frame table is still being built, render this frame on its own
+            buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            self.__set_palette()
+            self.renderer.render(buffer, self.__constructIndexes(*key), self.off_color)
+            self._buffer = buffer
+        else:
+            frame = frames[key]
+            if self.transitions is not None and self._key is not None and key != self._key:
+                self.transitions.start(self._buffer, frame)
+
+            if self.transitions is not None and self.transitions.active:
+                self._buffer = self.transitions.frame()
+            else:
+                self._buffer = frame
+        self._key = key
+
+    def wait_for_frames(self, timeout=None):
+        """Block until the frame table has been built, returns False on timeout."""
+        return self._frames_ready.wait(timeout)
+
+    def next_update(self):
+        """Seconds until the next minute where the displayed phrase changes."""
+        if self.simulate:
+            return super().next_update()
+        if self.transitions is not None and self.transitions.active:
+            return 1.0 / TRANSITION_FPS
+
+        now = datetime.datetime.now(self.timezone)
+        state = self.__state(now.hour, now.minute, now.weekday())
+        moment = now.replace(second=0, microsecond=0)
+        while True:
+            moment += datetime.timedelta(minutes=1)
+            if self.__state(moment.hour, moment.minute, moment.weekday()) != state:
+                break
+
+        # Check at least every minute, the system time may be adjusted by NTP
+        return min((moment - now).total_seconds(), 60.0)
+
+    def render_range(self, start, end, step=datetime.timedelta(minutes=1), out=None):
+        """Render the frame of every step from start up to end into an (N, height, width, 3) array."""
+        moments = time_range(start, end, step)
+        shape = (len(moments), self.height, self.width, 3)
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif out.shape != shape or out.dtype != np.uint8:
+            raise ValueError("Output array must be uint8 with shape {}".format(shape))
+
+        minute = moments.astype("datetime64[m]").astype(np.int64) % 60
+        hour = moments.astype("datetime64[h]").astype(np.int64) % 24
+        # 1970-01-01 was a Thursday
+        weekday = (moments.astype("datetime64[D]").astype(np.int64) + 3) % 7
+
+        frames = self._frames
+        if frames is None:
+            frames = self._frames = self.__construct_frames()
+        keys = np.ravel_multi_index(self.__state(hour, minute, weekday), frames.shape[:4])
+        np.take(frames.reshape(-1, self.height, self.width, 3), keys, axis=0, out=out)
+
+        return out
+
+    def save_range(self, path, start, end, step=datetime.timedelta(minutes=1)):
+        """Render a time range and save the frames and their times to a compressed npz file."""
+        frames = self.render_range(start, end, step)
+        np.savez_compressed(path, frames=frames, times=time_range(start, end, step))
 
     def __getCurrentTime(self):
         """Get current time information."""
-        now = datetime.datetime.now().time()
-        weekday = datetime.datetime.now().weekday()
-        return now.hour, now.minute, now.second, weekday
+        now = datetime.datetime.now(self.timezone)
+        return now.hour, now.minute, now.second, now.weekday()
 
     def __getSimulateTime(self):
         """Get simulated time information."""
@@ -194,47 +371,108 @@ class ClockPlugin(AbstractPlugin):
             self._sim_weekday % 7,
         )
 
-    def __constructIndexes(self, hour, minute, second, weekday):
-        """Get array of indexes which map with words to light up."""
+    def __state(self, hour, minute, weekday):
+        """Get the frame table key (minute slot, hour slot, weekday, soon) for a time.
+
+        Works on plain integers as well as on numpy arrays of times.
+        """
         # Check if an hour should be added
-        additional_hour = 1 if (minute >= 24) else 0
+        additional_hour = (minute >= 24) * 1
 
         hour_index = hour % 12 + additional_hour
-        minute_index = int(minute / 5)
-
-        soon = []
-        if minute / 5 % 1 > 0.7:
-            minute_index += 1
-            soon = self.soon
-
-        return (
-            self.prefix
-            + self.minutes[minute_index]
-            + self.hours[hour_index]
-            + self.weekdays[weekday]
-            + soon
-            + self.signature
-        )
 
-    def __construct_buffer(self, hour, minute, second, weekday):
-        """Construct display buffer given the current time and weekday."""
-        buffer = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        soon = (minute / 5 % 1 > 0.7) * 1
+        minute_index = minute // 5 + soon
 
-        led_indexes = self.__constructIndexes(hour, minute, second, weekday)
+        return minute_index, hour_index, weekday, soon
 
-        index = 0
-        for column in range(self.width):
-            for row in range(self.height):
-                if index in led_indexes:
-                    if index in range(139, 144):
-                        buffer[column, row] = self.signature_color
-                    elif index in range(132, 139):
-                        buffer[column, row] = self.day_color
-                    else:
-                        buffer[column, row] = self.on_color
-                else:
-                    buffer[column, row] = self.off_color
-
-                index += 1
+    def __constructIndexes(self, minute_index, hour_index, weekday, soon):
+        """Get array of indexes which map with words to light up."""
+        words = [
+            self.prefix,
+            self.minutes[minute_index],
+            self.hours[hour_index],
+            self.weekdays[weekday],
+            self.signature,
+        ]
+        if soon:
+            words.append(self.soon)
+
+        return np.concatenate(words)
+
+    def __set_palette(self):
+        """Set the color of each layout color group from the current colors."""
+        self.renderer.palette(
+            {
+                "on": self.on_color,
+                "day": self.day_color,
+                "signature": self.signature_color,
+            }
+        )
 
-        return buffer
+    def __construct_frames(self):
+        """Render every possible clock state into a read-only frame table.
+
+        Tables are shared by every clock with the same layout and colors.
+        """
+        key = (
+            self._layout,
+            self.width,
+            self.height,
+            tuple(self.on_color),
+            tuple(self.off_color),
+            tuple(self.day_color),
+            tuple(self.signature_color),
+        )
+        with _frame_tables_lock:
+            frames = _frame_tables.get(key)
+            if frames is None:
+                frames = self.__render_frames()
+                _frame_tables[key] = frames
+        return frames
+
+    def __render_frames(self):
+        frames = np.empty(
+            (
+                len(self.minutes),
+                len(self.hours),
+                len(self.weekdays),
+                2,
+                self.height,
+                self.width,
+                3,
+            ),
+            dtype=np.uint8,
+        )
+        self.__set_palette()
+        for key in np.ndindex(frames.shape[:4]):
+            self.renderer.render(
+                frames[key], self.__constructIndexes(*key), self.off_color
+            )
+
+        frames.flags.writeable = False
+        return frames
+
+    def __request_rebuild(self):
+        """Rebuild the frame table in the background after a color change."""
+        with self._rebuild_lock:
+            self._rebuild_pending = True
+            if self._rebuild_thread is None:
+                self._rebuild_thread = threading.Thread(
+                    target=self.__rebuild_frames, daemon=True
+                )
+                self._rebuild_thread.start()
+
+    def __rebuild_frames(self):
+        """Worker thread, keeps rebuilding until no color change is pending."""
+        while True:
+            with self._rebuild_lock:
+                if not self._rebuild_pending:
+                    self._rebuild_thread = None
+                    return
+                self._rebuild_pending = False
+
+            # Swapping the reference is atomic, update() picks up the new table
+            self._frames = self.__construct_frames()
+            self._frames_ready.set()
+            self.changed()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# Imports
+import math
+import time
+import numpy as np
+from plugins.abstract import AbstractPlugin
+
+BLEND_MODES = ("normal", "add", "multiply", "screen", "max")
+
+
+class Layer:
+    """A plugin in the compositor stack with its own opacity, blend mode and FPS."""
+
+    def __init__(self, plugin, opacity=1.0, blend="normal", fps=None, transparent_black=False):
+        if blend not in BLEND_MODES:
+            raise ValueError("Unknown blend mode: {}".format(blend))
+
+        self.plugin = plugin
+        self.opacity = opacity
+        self.blend = blend
+        self.fps = fps
+
+        # Treat black pixels as transparent, for overlays drawn on black
+        self.transparent_black = transparent_black
+
+        # Monotonic time the plugin should be updated next, and when it was last
+        self.due = 0.0
+        self.updated = None
+
+        # Buffer the current composite was blended from
+        self.blended = None
+
+    def next_update(self):
+        """Seconds between updates of the layer, None if only an event changes it."""
+        if self.fps:
+            return 1.0 / self.fps
+        return self.plugin.next_update()
+
+    @property
+    def opaque(self):
+        return self.blend == "normal" and self.opacity >= 1.0 and not self.transparent_black
+
+
+def same_frame(a, b):
+    """Check if two buffers are the same array or views of the same memory."""
+    if b is None:
+        return False
+    return a is b or (
+        a.shape == b.shape
+        and a.__array_interface__["data"][0] == b.__array_interface__["data"][0]
+    )
+
+
+class Compositor(AbstractPlugin):
+    """Blend the buffers of an ordered list of plugin layers, bottom layer first.
+
+    Layers are only updated when they are due and only re-blended, from the
+    lowest changed layer upwards, when their buffer changed.
+    """
+
+    def __init__(self, width=16, height=16, layers=(), topic_root="tidsram"):
+        super().__init__(width, height)
+        self.topic_root = topic_root
+        self.layers = []
+        self._stack = np.zeros((0, self.height, self.width, 3), dtype=np.float32)
+
+        # Scratch arrays for blending, frames are blended without allocating
+        shape = (self.height, self.width, 3)
+        self._black = np.zeros(shape, dtype=np.float32)
+        self._top = np.empty(shape, dtype=np.float32)
+        self._scratch = np.empty(shape, dtype=np.float32)
+        self._alpha = np.empty(shape, dtype=np.float32)
+        self._brightest = np.empty((self.height, self.width), dtype=np.uint8)
+        self._dark = np.empty((self.height, self.width), dtype=bool)
+
+        # The composite is overwritten by the next blend, the render loop
+        # copies it into the frame exchange with draw()
+        self._composite = np.zeros(shape, dtype=np.uint8)
+
+        for layer in layers:
+            self.add_layer(layer)
+
+    def add_layer(self, layer):
+        """Add a layer on top of the stack."""
+        layer.plugin.topic_root = self.topic_root
+        self.layers.append(layer)
+        self._stack = np.zeros(
+            (len(self.layers), self.height, self.width, 3), dtype=np.float32
+        )
+        for layer in self.layers:
+            layer.blended = None
+
+        # Wake the render loop and update the layer when its plugin changes
+        def changed(layer=layer):
+            layer.due = 0.0
+            self.changed()
+
+        layer.plugin.on_change = changed
+        self.fps = max(layer.fps or layer.plugin.fps for layer in self.layers)
+
+    def update(self, dt):
+        """Update the layers which are due and blend the ones that changed."""
+        now = time.monotonic()
+        lowest = None
+        for index, layer in enumerate(self.layers):
+            if now >= layer.due:
+                elapsed = dt if layer.updated is None else int((now - layer.updated) * 1000)
+                layer.plugin.update(elapsed)
+                layer.updated = now
+                interval = layer.next_update()
+                layer.due = math.inf if interval is None else now + interval
+
+            if lowest is None and not same_frame(layer.plugin.buffer, layer.blended):
+                lowest = index
+
+        if lowest is None:
+            return
+
+        # A single opaque layer is passed through as it is
+        if len(self.layers) == 1 and self.layers[0].opaque:
+            layer = self.layers[0]
+            layer.blended = layer.plugin.buffer
+            self._buffer = layer.blended
+            return
+
+        for index in range(lowest, len(self.layers)):
+            layer = self.layers[index]
+            layer.blended = layer.plugin.buffer
+            base = self._stack[index - 1] if index > 0 else None
+            self.blend(layer, base, self._stack[index])
+
+        np.copyto(self._composite, self._stack[-1], casting="unsafe")
+        self._buffer = self._composite
+
+    def blend(self, layer, base, out):
+        """Blend the buffer of a layer onto base, base None is black."""
+        top = self._top
+        np.copyto(top, layer.blended)
+        if layer.opaque:
+            np.copyto(out, top)
+            return
+
+        if base is None:
+            base = self._black
+
+        # Operands are kept at full shape, broadcasting makes numpy allocate buffers
+        alpha = self._alpha
+        alpha.fill(layer.opacity)
+        if layer.transparent_black:
+            blended = layer.blended
+            np.maximum(blended[..., 0], blended[..., 1], out=self._brightest)
+            np.maximum(self._brightest, blended[..., 2], out=self._brightest)
+            np.equal(self._brightest, 0, out=self._dark)
+            np.copyto(alpha, 0, where=self._dark[..., np.newaxis])
+
+        if layer.blend == "add":
+            top *= alpha
+            top += base
+            np.minimum(top, 255, out=out)
+            return
+        elif layer.blend == "multiply":
+            top *= base
+            top /= 255
+        elif layer.blend == "screen":
+            np.subtract(255, top, out=top)
+            np.subtract(255, base, out=self._scratch)
+            top *= self._scratch
+            top /= 255
+            np.subtract(255, top, out=top)
+        elif layer.blend == "max":
+            np.maximum(base, top, out=top)
+
+        # out = base + (top - base) * alpha
+        top -= base
+        top *= alpha
+        np.add(base, top, out=out)
+
+    def next_update(self):
+        """Seconds until the next layer is due, None if only events change the layers."""
+        due = min((layer.due for layer in self.layers), default=math.inf)
+        if due == math.inf:
+            return None
+        return max(due - time.monotonic(), 0.0)
+
+    @property
+    def topics(self):
+        return [topic for layer in self.layers for topic in layer.plugin.topics]
+
+    @property
+    def subscription_filter(self):
+        return self.topic_root + "/plugin/#"
+
+    def callback(self, client, userdata, msg):
+        """Pass the message to every layer whose subscription filter matches the topic."""
+        from paho.mqtt.client import topic_matches_sub
+
+        for layer in self.layers:
+            if topic_matches_sub(layer.plugin.subscription_filter, msg.topic):
+                layer.plugin.callback(client, userdata, msg)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Imports
+import time
+import numpy as np
+
+TRANSITIONS = ("none", "fade", "wipe", "cascade")
+
+# Frame rate while a transition runs
+TRANSITION_FPS = 60
+
+# Share of a cascade spent starting letters, the rest is each letter's own fade
+CASCADE_SPREAD = 0.6
+
+# Steps alternate between two buffers, so every step is a new array for the
+# compositor, which copies it before the next step is drawn
+OUTPUT_BUFFERS = 2
+
+
+class TransitionEngine:
+    """Blend between two frames over a fixed duration using precomputed weight tables.
+
+    Weights are fixed point, 0 shows the old frame and 256 the new frame.
+    The step shown is picked from the elapsed time, so a late frame skips
+    steps instead of slowing the transition down; skipped steps are counted
+    as dropped frames.
+    """
+
+    def __init__(self, width=16, height=16, kind="fade", duration=0.5, fps=TRANSITION_FPS):
+        if kind not in TRANSITIONS:
+            raise ValueError("Unknown transition: {}".format(kind))
+
+        self.width = width
+        self.height = height
+        self.kind = kind
+        self.duration = duration
+        self.fps = fps
+        self.steps = max(int(duration * fps), 1)
+
+        # Progress of each step, ending at exactly 1.0
+        progress = np.arange(1, self.steps + 1, dtype=np.float64) / self.steps
+        if kind == "wipe":
+            # Columns start one after another from the left with a soft edge
+            start = np.arange(width, dtype=np.float64) / width * CASCADE_SPREAD
+            weights = (progress[:, None] - start) / (1 - CASCADE_SPREAD)
+            weights = np.broadcast_to(weights[:, None, :], (self.steps, height, width))
+        else:
+            weights = np.broadcast_to(progress[:, None, None], (self.steps, height, width))
+        self._table = self.__fixed_point(weights)
+        self._weights = self._table
+
+        self._old = np.zeros((height, width, 3), dtype=np.int32)
+        self._delta = np.zeros((height, width, 3), dtype=np.int32)
+        self._work = np.zeros((height, width, 3), dtype=np.int32)
+        self._outputs = [
+            np.zeros((height, width, 3), dtype=np.uint8) for _ in range(OUTPUT_BUFFERS)
+        ]
+        self._output = 0
+
+        self.started = None
+        self.step = -1
+        self.frames = 0
+        self.dropped = 0
+        self.overruns = 0
+
+    @staticmethod
+    def __fixed_point(weights):
+        return (np.clip(weights, 0.0, 1.0) * 256).astype(np.int32)[..., None]
+
+    @property
+    def active(self):
+        return self.started is not None
+
+    def start(self, old, new, now=None):
+        """Start a transition from the old to the new frame."""
+        np.copyto(self._old, old)
+        np.subtract(new, self._old, out=self._delta)
+
+        if self.kind == "cascade":
+            # Changed letters start one after another in reading order
+            changed = self._delta.any(axis=2).ravel()
+            rank = np.cumsum(changed) - 1
+            start = rank / max(changed.sum(), 1) * CASCADE_SPREAD
+            progress = np.arange(1, self.steps + 1, dtype=np.float64) / self.steps
+            weights = (progress[:, None] - start) / (1 - CASCADE_SPREAD)
+            self._weights = self.__fixed_point(
+                weights.reshape(self.steps, self.height, self.width)
+            )
+        else:
+            self._weights = self._table
+
+        self.started = time.monotonic() if now is None else now
+        self.step = -1
+
+    def frame(self, now=None):
+        """Get the frame for the current time, None once the transition has finished."""
+        if self.started is None:
+            return None
+
+        began = time.monotonic()
+        now = began if now is None else now
+        step = min(int((now - self.started) * self.fps), self.steps - 1)
+        if step <= self.step:
+            step = min(self.step + 1, self.steps - 1)
+        self.dropped += max(step - self.step - 1, 0)
+        self.step = step
+
+        # old + delta * weight / 256, in place
+        np.multiply(self._delta, self._weights[step], out=self._work)
+        np.right_shift(self._work, 8, out=self._work)
+        np.add(self._work, self._old, out=self._work)
+
+        output = self._outputs[self._output]
+        self._output = (self._output + 1) % OUTPUT_BUFFERS
+        np.copyto(output, self._work, casting="unsafe")
+        self.frames += 1
+
+        if step == self.steps - 1:
+            self.started = None
+        if time.monotonic() - began > 1.0 / self.fps:
+            self.overruns += 1
+
+        return output
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the render path.
+Run from the repository root, e.g. python -m tools.benchmark --output results.json
+"""
+
+# Imports
+import argparse
+import datetime
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+from plugins.abstract import AbstractPlugin
+
+# Default number of timed and untimed calls per benchmark
+ITERATIONS = 1000
+WARMUP = 100
+
+# Display size of the allocation check, large enough that a frame sized
+# allocation stands out from the bookkeeping of numpy calls
+ALLOCATION_SIZE = 64
+
+# Bytes a steady state frame may allocate, the array views and scalars
+# numpy creates per call. Less than one 64x64 mask, let alone a frame
+ALLOCATION_BUDGET = 3072
+
+
+class Message:
+    """Minimal stand-in for a paho MQTTMessage."""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode("utf-8")
+
+
+class Alternating(AbstractPlugin):
+    """Plugin alternating between two frames on every update, so layers above it are blended."""
+
+    def __init__(self, frames):
+        super().__init__(frames[0].shape[1], frames[0].shape[0])
+        self.frames = frames
+        self.count = 0
+
+    def update(self, dt):
+        self.count += 1
+        self._buffer = self.frames[self.count & 1]
+
+    def next_update(self):
+        return 0.0
+
+    topics = []
+    subscription_filter = "tidsram/benchmark/#"
+
+    def callback(self, client, userdata, msg):
+        pass
+
+
+class StubStrip:
+    """Stand-in for an rpi_ws281x strip, keeps the colors set instead of driving LEDs.
+
+    Like the driver's LED buffer the colors are plain words, a list would
+    keep the int objects set and count them as allocated.
+    """
+
+    def __init__(self, count):
+        self.colors = np.zeros(count, dtype=np.uint32)
+
+    def setPixelColor(self, index, color):
+        self.colors[index] = color
+
+    def setBrightness(self, brightness):
+        pass
+
+    def show(self):
+        pass
+
+
+def summarize(samples):
+    """Get statistics in nanoseconds for an array of samples."""
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        "iterations": int(len(samples)),
+        "mean_ns": float(samples.mean()),
+        "min_ns": int(samples.min()),
+        "max_ns": int(samples.max()),
+        "p50_ns": float(p50),
+        "p95_ns": float(p95),
+        "p99_ns": float(p99),
+    }
+
+
+def measure(function, iterations=ITERATIONS, warmup=WARMUP):
+    """Time each call of function with perf_counter_ns after a number of warmup calls."""
+    for _ in range(warmup):
+        function()
+
+    samples = np.empty(iterations, dtype=np.int64)
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        function()
+        samples[i] = time.perf_counter_ns() - start
+
+    return summarize(samples)
+
+
+def bench_clock_update(iterations):
+    from plugins.clock import ClockPlugin
+
+    plugin = ClockPlugin(12, 12)
+    plugin.wait_for_frames()
+    return measure(lambda: plugin.update(200), iterations)
+
+
+def bench_display_show(backend, iterations):
+    from app import create_display
+    from plugins.clock import ClockPlugin
+
+    display = create_display(backend)
+    plugin = ClockPlugin(display.width, display.height)
+    plugin.wait_for_frames()
+    plugin.update(0)
+    display.buffer = plugin.buffer
+
+    # Alternate between two frames so diffing backends have work to do
+    frames = [plugin.buffer, np.ascontiguousarray(plugin.buffer[::-1])]
+    count = [0]
+
+    def show():
+        display.buffer = frames[count[0] & 1]
+        count[0] += 1
+        display.show()
+
+    return measure(show, iterations)
+
+
+def bench_handoff(iterations):
+    from core.frames import FrameExchange
+    from display.memory import Memory
+    from plugins.clock import ClockPlugin
+
+    display = Memory(12, 12)
+    plugin = ClockPlugin(12, 12)
+    plugin.wait_for_frames()
+    plugin.update(0)
+    frames = FrameExchange(display.buffer.shape)
+
+    def handoff():
+        frames.publish(plugin.buffer)
+        _, display.buffer = frames.acquire()
+
+    return measure(handoff, iterations)
+
+
+def scratch_config(**sections):
+    """Get a copy of settings.conf with some settings replaced, never watched or written back."""
+    from core.config import Config
+
+    config = Config()
+    config.read("settings.conf")
+    for section, settings in sections.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in settings.items():
+            config.set(section, key, value)
+    return config
+
+
+def bench_mqtt_latency(iterations):
+    """Time from an MQTT color message being handled until the new color is shown."""
+    from app import WordClock
+
+    config = scratch_config(tidsram={"prometheus_file": "", "record_file": ""})
+
+    wordclock = WordClock(config, backend="memory")
+    wordclock.clock.wait_for_frames()
+    callback = wordclock.messages.wrap(wordclock.source.callback)
+    original = wordclock.clock.on_color
+
+    thread = threading.Thread(target=wordclock.renderloop, daemon=True)
+    thread.start()
+
+    # The first letter is always lit, toggle its color between two values
+    colors = [tuple(255 - c for c in original), original]
+
+    def latency(color):
+        shown = wordclock.display.frame_count
+        start = time.perf_counter_ns()
+        callback(None, None, Message("tidsram/plugin/clock/on", "#{:02x}{:02x}{:02x}".format(*color)))
+        while True:
+            frame = wordclock.display.last_frame
+            if wordclock.display.frame_count > shown and tuple(frame[0, 0].tolist()) == color:
+                return time.perf_counter_ns() - start
+            time.sleep(0.0001)
+
+    for i in range(WARMUP // 10):
+        latency(colors[i & 1])
+    samples = np.array([latency(colors[i & 1]) for i in range(iterations)], dtype=np.int64)
+
+    wordclock.stop()
+    thread.join()
+    return summarize(samples)
+
+
+def allocated(function, iterations=ITERATIONS, warmup=WARMUP):
+    """Get the peak number of bytes allocated while calling function, after a number of warmup calls."""
+    tracemalloc.start()
+    try:
+        for _ in range(warmup):
+            function()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(iterations):
+            function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - current
+
+
+def check_allocations(iterations, size=ALLOCATION_SIZE, budget=ALLOCATION_BUDGET):
+    """Check that steady state frames allocate no buffers, returns True if they do not.
+
+    Frames are rendered with WordClock.render, from the clock and a layer
+    blended on top of it through the compositor and the frame exchange to
+    the memory, spi and ws2812b displays, the strip of the last one is a
+    stand-in. The clock runs in simulated time and is updated every frame,
+    so every frame shows a new phrase.
+    """
+    from app import WordClock
+    from display.memory import Memory
+    from display.spi import SPI
+    from display.ws2812b import WS2812B
+    from plugins.compositor import Layer
+
+    config = scratch_config(
+        tidsram={"prometheus_file": "", "record_file": ""},
+        tidsram_clock={"simulate": "True", "width": str(size), "height": str(size)},
+    )
+    rng = np.random.default_rng(0)
+    overlay = Alternating([rng.integers(0, 256, (size, size, 3), dtype=np.uint8) for _ in range(2)])
+
+    passed = True
+    with tempfile.NamedTemporaryFile() as device:
+        displays = (
+            Memory(size, size),
+            SPI(size, size, device.name, config),
+            WS2812B(size, size, config, strip=StubStrip(size * size)),
+        )
+        for display in displays:
+            wordclock = WordClock(config, display=display)
+            wordclock.clock.wait_for_frames()
+            # Due again right away, so the clock is updated on every frame
+            wordclock.source.layers[0].fps = math.inf
+            wordclock.source.add_layer(Layer(overlay, 0.5, "screen", transparent_black=True))
+
+            peak = allocated(wordclock.render, iterations)
+            ok = peak < budget
+            passed = passed and ok
+            print(
+                "{:<20} {:>12} bytes {:>8}".format(
+                    "frame_" + type(display).__name__.lower(), peak, "ok" if ok else "FAILED"
+                )
+            )
+            if isinstance(display, SPI):
+                display.close()
+
+    return passed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(backends, iterations):
+    results = {
+        "clock_update": bench_clock_update(iterations),
+        "handoff": bench_handoff(iterations),
+    }
+    for backend in backends:
+        results["show_" + backend] = bench_display_show(backend, iterations)
+    results["mqtt_latency"] = bench_mqtt_latency(max(iterations // 20, 10))
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+
+
+def report(report, baseline=None):
+    print("{:<20} {:>12} {:>12} {:>12} {:>10}".format("benchmark", "p50 us", "p95 us", "p99 us", "p50 diff"))
+    for name, result in report["results"].items():
+        diff = ""
+        if baseline is not None and name in baseline["results"]:
+            before = baseline["results"][name]["p50_ns"]
+            diff = "{:+.1f}%".format((result["p50_ns"] - before) / before * 100)
+        print(
+            "{:<20} {:>12.1f} {:>12.1f} {:>12.1f} {:>10}".format(
+                name,
+                result["p50_ns"] / 1000,
+                result["p95_ns"] / 1000,
+                result["p99_ns"] / 1000,
+                diff,
+            )
+        )
+
+
+# Main body
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tidsram render path.")
+    parser.add_argument("--backends", default="memory", help="comma separated display backends to benchmark")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--output", help="write the results to a json file")
+    parser.add_argument("--compare", help="json result file to compare against")
+    parser.add_argument(
+        "--allocations",
+        action="store_true",
+        help="only check that steady state frames allocate no buffers",
+    )
+    args = parser.parse_args()
+
+    if args.allocations:
+        sys.exit(0 if check_allocations(args.iterations) else 1)
+
+    result = run(args.backends.split(","), args.iterations)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
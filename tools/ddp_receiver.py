@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Reference DDP receiver, shows frames streamed by the ddp display backend.
+Run from the repository root, e.g. python -m tools.ddp_receiver --display computer
+"""
+
+# Imports
+import argparse
+import socket
+import numpy as np
+from display.ddp import DDP_HEADER, DDP_PORT, DDP_PUSH, DDP_SEQUENCES
+
+
+class DDPReceiver:
+    """Assemble DDP packets into frames, dropping packets older than the last one."""
+
+    def __init__(self, width=12, height=12, host="127.0.0.1", port=DDP_PORT):
+        self.width = width
+        self.height = height
+        self.frame = np.zeros(width * height * 3, dtype=np.uint8)
+        self.sequence = None
+        self.frames = 0
+        self.dropped = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+
+    def stale(self, sequence):
+        """Check if a sequence number is older than the last one received."""
+        if sequence == 0 or self.sequence is None:
+            return False
+        distance = (sequence - self.sequence) % DDP_SEQUENCES
+        return distance > DDP_SEQUENCES // 2
+
+    def handle(self, packet):
+        """Apply one packet, returns True when it completed a frame."""
+        if len(packet) < DDP_HEADER.size:
+            return False
+        flags, sequence, _, _, offset, length = DDP_HEADER.unpack_from(packet)
+        if self.stale(sequence):
+            self.dropped += 1
+            return False
+        if sequence:
+            self.sequence = sequence
+
+        data = np.frombuffer(packet, dtype=np.uint8, count=length, offset=DDP_HEADER.size)
+        self.frame[offset : offset + len(data)] = data[: len(self.frame) - offset]
+
+        if flags & DDP_PUSH:
+            self.frames += 1
+            return True
+        return False
+
+    def receive(self):
+        """Block until a complete frame has been received, returns it as (height, width, 3)."""
+        while not self.handle(self.socket.recv(2048)):
+            pass
+        return self.frame.reshape(self.height, self.width, 3)
+
+
+# Main body
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive DDP frames and show them.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DDP_PORT)
+    parser.add_argument("--width", type=int, default=12)
+    parser.add_argument("--height", type=int, default=12)
+    parser.add_argument("--display", default="memory", help="display backend showing the frames")
+    args = parser.parse_args()
+
+    from app import create_display
+
+    display = create_display(args.display, args.width, args.height)
+    receiver = DDPReceiver(args.width, args.height, args.host, args.port)
+    while True:
+        display.buffer = receiver.receive().copy()
+        display.show()
+        print("frame {} ({} stale packets dropped)".format(receiver.frames, receiver.dropped))
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Render every frame the clock shows in a time range to a compressed npz file.
+Run from the repository root, e.g. python -m tools.render_range 2024-01-01 --days 7 --output week.npz
+"""
+
+# Imports
+import argparse
+import datetime
+from plugins.clock import ClockPlugin
+
+# Main body
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a time range of clock frames.")
+    parser.add_argument("start", type=datetime.datetime.fromisoformat, help="first time, ISO format")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--step", type=int, default=60, help="seconds between frames")
+    parser.add_argument("--output", default="frames.npz")
+    args = parser.parse_args()
+
+    plugin = ClockPlugin(12, 12)
+    plugin.save_range(
+        args.output,
+        args.start,
+        args.start + datetime.timedelta(days=args.days),
+        datetime.timedelta(seconds=args.step),
+    )
+    print("Saved frames to {}".format(args.output))
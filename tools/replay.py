@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Replay the frames of a recording through a display backend.
+Run from the repository root, e.g. python -m tools.replay frames.rec --display computer --speed 10
+"""
+
+# Imports
+import argparse
+import time
+import numpy as np
+from core.recorder import FrameRecorder
+
+
+def replay(recording, display, speed=1.0):
+    """Show every frame of a recording, speed 0 shows them as fast as possible.
+
+    Returns the time spent in show() for each frame in nanoseconds.
+    """
+    frames = recording.frames()
+    samples = np.empty(len(frames), dtype=np.int64)
+    if not len(frames):
+        return samples
+
+    start = time.monotonic()
+    first = frames["time"][0]
+    for i, record in enumerate(frames):
+        if speed > 0:
+            delay = start + (record["time"] - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            display.poll()
+
+        display.buffer = np.ascontiguousarray(record["frame"])
+        shown = time.perf_counter_ns()
+        display.show()
+        samples[i] = time.perf_counter_ns() - shown
+
+    return samples
+
+
+# Main body
+if __name__ == "__main__":
+    from app import create_display
+    from tools.benchmark import summarize
+
+    parser = argparse.ArgumentParser(description="Replay a frame recording on a display.")
+    parser.add_argument("recording", help="file written by the recorder, record_file in settings.conf")
+    parser.add_argument("--display", default="computer", help="display backend to show the frames on")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 for as fast as possible")
+    args = parser.parse_args()
+
+    recording = FrameRecorder(args.recording, mode="r")
+    frames = recording.frames()
+    print(
+        "{} frame(s), sequence {} to {}, {:.1f} seconds".format(
+            len(frames),
+            frames["sequence"][0] if len(frames) else "-",
+            frames["sequence"][-1] if len(frames) else "-",
+            frames["time"][-1] - frames["time"][0] if len(frames) else 0.0,
+        )
+    )
+
+    display = create_display(args.display, recording.width, recording.height)
+    samples = replay(recording, display, args.speed)
+    if len(samples):
+        result = summarize(samples)
+        print(
+            "show p50 {:.1f} us, p95 {:.1f} us, p99 {:.1f} us".format(
+                result["p50_ns"] / 1000, result["p95_ns"] / 1000, result["p99_ns"] / 1000
+            )
+        )